@@ -1,6 +1,7 @@
 from django.contrib import admin
-from image_uploader.models import User, AccountTier
+from image_uploader.models import User, AccountTier, ImageJob
 
 
 admin.site.register(AccountTier)
 admin.site.register(User)
+admin.site.register(ImageJob)
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+
+from .authentication import CachedTokenAuthentication
+from .executors import RenderQueueFull
+from .models import AccountTier, UploadedImage
+from .responses import conditional_file_response_async, make_etag
+from .signing import read_expiring_link
+from .thumbnails import ImageTooLarge, get_thumbnail, get_thumbnail_key, negotiate_output_format
+from .tokens import ExpiredToken, InvalidToken
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_image_executor() -> ThreadPoolExecutor:
+    '''
+    This function returns the thread pool rendering thumbnails for the async views. Its size bounds how many
+    images are decoded at the same time, however many requests are waiting.
+    '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_IMAGE_THREADS, thread_name_prefix='image-render')
+        return _executor
+
+
+def error_response(error: str, status: int = 400) -> JsonResponse:
+    return JsonResponse({"error": error}, status=status)
+
+
+def busy_response() -> JsonResponse:
+    response = error_response("Too many images are being processed, try again later", 503)
+    response['Retry-After'] = str(settings.THUMBNAIL_RENDER_RETRY_AFTER)
+    return response
+
+
+async def authenticate(request: HttpRequest):
+    '''
+    This function returns the user of the "Authorization: Token <key>" header, or None without valid credentials.
+    '''
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != b'token':
+        return None
+    try:
+        key = auth[1].decode()
+        user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(key)
+    except (UnicodeError, exceptions.AuthenticationFailed):
+        return None
+    return user
+
+
+def not_found_response() -> JsonResponse:
+    # The body of DRF's Http404 handling in the sync views.
+    return JsonResponse({"detail": "Not found."}, status=404)
+
+
+def unauthorized_response() -> JsonResponse:
+    response = JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def aget_image(queryset=UploadedImage.objects, **lookup) -> Optional[UploadedImage]:
+    try:
+        return await queryset.aget(**lookup)
+    except UploadedImage.DoesNotExist:
+        return None
+
+
+async def serve_original_async(request: HttpRequest, image: UploadedImage, max_age: int) -> HttpResponse:
+    return await conditional_file_response_async(
+        request, image.open_image, 'image/' + image.image_format, image.etag,
+        image.get_modified_time(), max_age, allow_ranges=True)
+
+
+def too_large_response() -> JsonResponse:
+    return error_response("The image is too large to create thumbnails for this user's tier")
+
+
+async def serve_thumbnail_async(request: HttpRequest, image: UploadedImage, height: int, max_age: int,
+                                tier: Optional[AccountTier] = None) -> HttpResponse:
+    encoding = tier.encoding if tier else None
+    max_pixels = tier.image_pixel_limit if tier else None
+    image_format = negotiate_output_format(image, request.META.get('HTTP_ACCEPT', ''))
+    key = get_thumbnail_key(image, height, image_format, encoding)
+    # Cache hits and waits for the render lock or a render slot run on the default executor; only renders take
+    # the threads of the image executor.
+    response = await conditional_file_response_async(
+        request, lambda: get_thumbnail(image, height, image_format, key, encoding, max_pixels,
+                                       render_executor=get_image_executor())[0],
+        'image/' + image_format, make_etag(key), image.get_modified_time(), max_age)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+class AsyncImageOriginalView(View):
+    async def get(self, request: HttpRequest, public_id: str) -> HttpResponse:
+        user = await authenticate(request)
+        if user is None:
+            return unauthorized_response()
+        if not user.tier.access_to_original_image:
+            return error_response("The requested original image is not allowed for this user's tier")
+        image = await aget_image(user=user.id, public_id=public_id)
+        if image is None:
+            return not_found_response()
+        try:
+            return await serve_original_async(request, image, user.tier.cache_max_age)
+        except IOError:
+            return error_response("Unable to read image file")
+
+
+class AsyncImageThumbnailView(View):
+    async def get(self, request: HttpRequest, public_id: str, height: int) -> HttpResponse:
+        user = await authenticate(request)
+        if user is None:
+            return unauthorized_response()
+        if height not in user.tier.thumbnail_heights:
+            return error_response("The requested thumbnail height is not allowed for this user's tier")
+        image = await aget_image(user=user.id, public_id=public_id)
+        if image is None:
+            return not_found_response()
+        try:
+            return await serve_thumbnail_async(
+                request, image, height, user.tier.cache_max_age, user.tier)
+        except RenderQueueFull:
+            return busy_response()
+        except ImageTooLarge:
+            return too_large_response()
+        except IOError:
+            return error_response("Unable to read image file")
+
+
+class AsyncExpiringLinkView(View):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        try:
+            image_id, height, expires_at, path = read_expiring_link(request.GET.get('signature', ''))
+        except ExpiredToken:
+            return error_response("URL has expired")
+        except InvalidToken:
+            return error_response("Invalid URL")
+
+        if path is None:
+            image = await aget_image(UploadedImage.objects.select_related('user__tier'), pk=image_id)
+        else:
+            # Links signed as image view URLs were fetched with the credentials of the request, as the user's image.
+            user = await authenticate(request)
+            if user is None:
+                return unauthorized_response()
+            if height is None and not user.tier.access_to_original_image:
+                return error_response("The requested original image is not allowed for this user's tier")
+            if height is not None and height not in user.tier.thumbnail_heights:
+                return error_response("The requested thumbnail height is not allowed for this user's tier")
+            image = await aget_image(user=user.id, name=os.path.basename(path))
+            if image is not None:
+                image.user = user
+        if image is None:
+            return not_found_response()
+        max_age = int(expires_at - time.time())
+        try:
+            if height:
+                return await serve_thumbnail_async(
+                    request, image, int(height), max_age, image.user.tier)
+            return await serve_original_async(request, image, max_age)
+        except RenderQueueFull:
+            return busy_response()
+        except ImageTooLarge:
+            return too_large_response()
+        except IOError:
+            return error_response("Unable to read image file")
@@ -0,0 +1,48 @@
+import hashlib
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key: str) -> str:
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+
+def invalidate_tokens(keys: Iterable[str]) -> None:
+    get_token_cache().delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Token authentication resolving token, user and account tier with a single query and caching the
+    result for AUTH_TOKEN_CACHE_TIMEOUT seconds in the AUTH_TOKEN_CACHE_ALIAS cache.
+
+    Cached entries are invalidated by signals when a token, user or tier changes. With a per-process
+    cache (the default local-memory backend) other processes only see such changes once their entry
+    expires; use a shared cache backend when that delay is not acceptable.
+    '''
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user__tier').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
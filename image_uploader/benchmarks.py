@@ -0,0 +1,333 @@
+import datetime
+import io
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import django
+import PIL
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signing import Signer
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import AccountTier, generate_public_id
+from .thumbnails import save_thumbnail, supported_output_formats
+from .tokens import make_token, read_token
+from .utils import ImageURLBuilder, resize_image_by_height
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str) -> Callable:
+    '''
+    This decorator registers a benchmark suite under name. A suite receives the command options and returns a JSON serializable dict.
+    '''
+    def register(function: Callable) -> Callable:
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def measure(function: Callable[[], None], iterations: int, warmup: int = 1) -> dict:
+    '''
+    This function calls function warmup + iterations times and returns latency percentiles in milliseconds,
+    throughput in calls per second and the process peak RSS in kilobytes. Peak RSS is a high-water mark
+    of the whole process, so run a single suite per process when comparing memory.
+    '''
+    for _ in range(warmup):
+        function()
+    rss_before = peak_rss_kb()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies),
+        'throughput_per_s': iterations / elapsed if elapsed else None,
+        'peak_rss_kb': peak_rss_kb(),
+        'peak_rss_growth_kb': peak_rss_kb() - rss_before,
+    }
+
+
+def generate_image(width: int, height: int, image_format: str) -> bytes:
+    '''
+    This function returns a synthetic image encoded in image_format. The content mixes a fractal with
+    gradients so encoders see realistic detail instead of flat colour.
+    '''
+    fractal = Image.effect_mandelbrot((width, height), (-2.0, -1.25, 0.75, 1.25), 64)
+    horizontal = Image.linear_gradient('L').rotate(90).resize((width, height))
+    vertical = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (fractal, horizontal, vertical))
+    output = io.BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+
+def generate_corpus(sizes: List[int], formats: List[str]) -> Dict[str, bytes]:
+    '''
+    This function returns synthetic images keyed by "<format>-<width>", each with a 4:3 aspect ratio.
+    '''
+    corpus = {}
+    for image_format in formats:
+        for size in sizes:
+            corpus[f'{image_format.lower()}-{size}'] = generate_image(
+                size, size * 3 // 4, image_format.upper())
+    return corpus
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def environment() -> dict:
+    return {
+        'commit': git_commit(),
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pillow': PIL.__version__,
+        'database': connection.vendor,
+    }
+
+
+def check_status(response, expected: int = 200) -> None:
+    if response.status_code != expected:
+        raise RuntimeError(
+            f'{response.request["PATH_INFO"]} returned {response.status_code}, expected {expected}')
+
+
+class Rollback(Exception):
+    pass
+
+
+@benchmark('views')
+def benchmark_views(options: dict) -> dict:
+    '''
+    Measures every view of image_uploader.views against a synthetic corpus. All rows are created in a
+    transaction that is rolled back and files are written to a temporary MEDIA_ROOT.
+    '''
+    corpus = generate_corpus(options['sizes'], options['formats'])
+    iterations = options['iterations']
+    heights = [200, 400]
+    results = {}
+    media_root = tempfile.mkdtemp(prefix='image-uploader-benchmark-')
+    try:
+        with override_settings(MEDIA_ROOT=media_root), transaction.atomic():
+            tier = AccountTier.objects.create(
+                name=f'benchmark-{time.time_ns()}', thumbnail_heights=heights,
+                access_to_original_image=True, expiring_link_creation=True)
+            user = get_user_model().objects.create_user(
+                username=f'benchmark-{time.time_ns()}', tier=tier)
+            client = APIClient()
+            client.force_authenticate(user=user)
+
+            for name, data in corpus.items():
+                file_name = f'{name}.{name.split("-")[0]}'
+                uploaded = []
+
+                def upload():
+                    response = client.post(reverse('image_upload'), {
+                        'image': _named_file(data, file_name)}, format='multipart')
+                    check_status(response, 201)
+                    uploaded.append(list(response.json().keys())[0])
+
+                results[f'upload/{name}'] = measure(upload, iterations)
+                path = uploaded[0]
+                thumbnail_url = reverse('get_thumbnail', kwargs={'path': path, 'height': heights[0]})
+                thumbnail_cache = os.path.join(media_root, settings.THUMBNAIL_CACHE_DIR)
+
+                def thumbnail_cold():
+                    shutil.rmtree(thumbnail_cache, ignore_errors=True)
+                    _consume(client.get(thumbnail_url))
+
+                def thumbnail():
+                    _consume(client.get(thumbnail_url))
+
+                def original():
+                    _consume(client.get(reverse('get_image', kwargs={'path': path})))
+
+                def expiring_link():
+                    response = client.get(reverse('get_expiring_url', args=[path, heights[0], 3600]))
+                    check_status(response)
+                    _consume(client.get(response.data['expiring_url']))
+
+                results[f'thumbnail_cold/{name}'] = measure(thumbnail_cold, iterations)
+                results[f'thumbnail/{name}'] = measure(thumbnail, iterations)
+                results[f'original/{name}'] = measure(original, iterations)
+                results[f'expiring_link/{name}'] = measure(expiring_link, iterations)
+
+            def image_list():
+                _consume(client.get(reverse('user_image_list')))
+
+            results['list'] = measure(image_list, iterations)
+            raise Rollback
+    except Rollback:
+        pass
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    return results
+
+
+@benchmark('urls')
+def benchmark_urls(options: dict) -> dict:
+    '''
+    Measures building the URL dictionaries of a listing page, calling reverse() and build_absolute_uri()
+    for every URL (as create_image_url_dict did) against ImageURLBuilder templates.
+    '''
+    request = RequestFactory().get(reverse('user_image_list'))
+    heights = [200, 400]
+    results = {}
+    for count in (100, 1000):
+        names = [generate_public_id() for _ in range(count)]
+
+        def per_url():
+            for name in names:
+                {
+                    'original_url': request.build_absolute_uri(reverse('get_image_by_id', args=[name])),
+                    'thumbnails': [{'height': height, 'url': request.build_absolute_uri(reverse(
+                        'get_thumbnail_by_id', kwargs={'public_id': name, 'height': height}))} for height in heights],
+                }
+
+        def templates():
+            url_builder = ImageURLBuilder(request, True, heights)
+            for name in names:
+                url_builder.build(name)
+
+        results[f'reverse/{count}'] = measure(per_url, options['iterations'])
+        results[f'templates/{count}'] = measure(templates, options['iterations'])
+    return results
+
+
+@benchmark('encoders')
+def benchmark_encoders(options: dict) -> dict:
+    '''
+    Measures encoding thumbnails of the synthetic corpus with every THUMBNAIL_ENCODING_PROFILES entry in each
+    output format the installed Pillow supports, reporting the encoded size next to the encode time.
+    '''
+    corpus = generate_corpus(options['sizes'], options['formats'])
+    output_formats = ['JPEG', 'PNG'] + supported_output_formats()
+    results = {}
+    for name, data in corpus.items():
+        with Image.open(io.BytesIO(data)) as original:
+            thumbnails = [resize_image_by_height(original, height) for height in (200, 400)
+                          if height < original.height]
+        for thumbnail in thumbnails:
+            for profile in settings.THUMBNAIL_ENCODING_PROFILES:
+                for image_format in output_formats:
+                    output = io.BytesIO()
+
+                    def encode():
+                        output.seek(0)
+                        output.truncate()
+                        save_thumbnail(thumbnail, image_format, output, {'profile': profile})
+
+                    result = measure(encode, options['iterations'])
+                    result['size_bytes'] = output.tell()
+                    results[f'{profile}/{image_format.lower()}/{name}/{thumbnail.height}'] = result
+    return results
+
+
+@benchmark('tokens')
+def benchmark_tokens(options: dict) -> dict:
+    '''
+    Measures signing and verifying 1000 expiring links as compact tokens against the Signer-signed JSON objects
+    used before them, reporting the signature length of each.
+    '''
+    count = 1000
+    expires_at = timezone.now().replace(microsecond=0) + timezone.timedelta(seconds=3600)
+    links = [(image_id, 200 if image_id % 2 else None) for image_id in range(1, count + 1)]
+    signer = Signer()
+    signatures = [signer.sign_object({"image": image_id, "height": height, "expires_at": expires_at.isoformat()})
+                  for image_id, height in links]
+    tokens = [make_token(image_id, height, int(expires_at.timestamp())) for image_id, height in links]
+
+    def signer_sign():
+        for image_id, height in links:
+            signer.sign_object({"image": image_id, "height": height, "expires_at": expires_at.isoformat()})
+
+    def signer_verify():
+        for signature in signatures:
+            signed_data = signer.unsign_object(signature)
+            datetime.datetime.fromisoformat(signed_data['expires_at']) < timezone.now()
+
+    def token_sign():
+        for image_id, height in links:
+            make_token(image_id, height, int(expires_at.timestamp()))
+
+    def token_verify():
+        for token in tokens:
+            read_token(token)
+
+    results = {
+        f'signer_sign/{count}': measure(signer_sign, options['iterations']),
+        f'signer_verify/{count}': measure(signer_verify, options['iterations']),
+        f'token_sign/{count}': measure(token_sign, options['iterations']),
+        f'token_verify/{count}': measure(token_verify, options['iterations']),
+    }
+    results['signer_length'] = max(len(signature) for signature in signatures)
+    results['token_length'] = max(len(token) for token in tokens)
+    return results
+
+
+def _named_file(data: bytes, name: str) -> io.BytesIO:
+    file = io.BytesIO(data)
+    file.name = name
+    return file
+
+
+def _consume(response) -> None:
+    check_status(response)
+    if response.streaming:
+        # The test client closes the response once its content is exhausted.
+        for _ in response.streaming_content:
+            pass
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    '''
+    This function returns a line for every measurement whose median latency grew by more than threshold (0.1 = 10%) over the baseline.
+    '''
+    regressions = []
+    for suite, measurements in results.items():
+        for name, current in measurements.items():
+            previous = baseline.get('results', {}).get(suite, {}).get(name)
+            if not previous or not isinstance(current, dict) or 'p50_ms' not in current:
+                continue
+            if current['p50_ms'] > previous['p50_ms'] * (1 + threshold):
+                regressions.append(
+                    f'{suite} {name}: p50 {previous["p50_ms"]:.2f} ms -> {current["p50_ms"]:.2f} ms')
+    return regressions
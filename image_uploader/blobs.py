@@ -0,0 +1,61 @@
+import hashlib
+from typing import BinaryIO
+
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.db import connection, transaction
+
+
+def blob_name(directory: str, content_hash: str, image_format: str) -> str:
+    '''
+    This function returns the storage name of the blob with the given content hash. Blobs are sharded into
+    <directory><hash[:2]>/<hash[2:4]>/ subdirectories, so no directory of a file system storage grows past a few
+    thousand entries.
+    '''
+    return f'{directory}{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.{image_format.lower()}'
+
+
+def lock_blob(name: str, shared: bool = False) -> None:
+    '''
+    This function takes a PostgreSQL advisory lock on the blob until the current transaction ends. Uploads
+    referencing the blob hold it shared from storing the blob until their row is committed, and release_blob
+    holds it exclusively while it checks for references and deletes the blob, so a blob is never deleted under
+    an upload that found it already stored. Does nothing on other databases.
+    '''
+    if connection.vendor != 'postgresql':
+        return
+    lock_id = int(hashlib.sha256(name.encode()).hexdigest()[:16], 16) - 2 ** 63
+    with connection.cursor() as cursor:
+        if shared:
+            cursor.execute('SELECT pg_advisory_xact_lock_shared(%s)', [lock_id])
+        else:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [lock_id])
+
+
+def store_blob(storage: Storage, name: str, file: BinaryIO) -> str:
+    '''
+    This function saves file under the content-addressed name unless a blob with that name is already stored,
+    in which case nothing is written. Returns the stored name. Has to be called in the transaction that creates
+    the row referencing the blob.
+    '''
+    lock_blob(name, shared=True)
+    if storage.exists(name):
+        return name
+    stored_name = storage.save(name, File(file, name=name))
+    if stored_name != name:
+        # Another upload stored the same content in the meantime; keep a single copy.
+        storage.delete(stored_name)
+    return name
+
+
+def release_blob(storage: Storage, name: str, content_hash: str) -> None:
+    '''
+    This function deletes the blob once no UploadedImage row references it anymore. Rows are looked up by their
+    indexed content hash.
+    '''
+    from .models import UploadedImage
+
+    with transaction.atomic():
+        lock_blob(name)
+        if not UploadedImage.objects.filter(content_hash=content_hash, image=name).exists():
+            storage.delete(name)
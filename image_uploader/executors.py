@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+import threading
+import time
+from typing import Iterator
+
+from django.conf import settings
+
+
+class RenderQueueFull(Exception):
+    '''
+    Raised when an image transform could not be admitted within the queue timeout.
+    '''
+
+
+class RenderLimiter:
+    '''
+    Admission control for CPU and memory heavy image transforms running in the threads of this process.
+
+    At most max_concurrency transforms run at once and the pixel counts of their source images add up to at
+    most max_pixels, so a few huge originals take the place of many small ones. An image larger than
+    max_pixels is admitted only when nothing else is running. Callers wait up to a timeout for a slot.
+    '''
+
+    def __init__(self, max_concurrency: int, max_pixels: int):
+        self.max_concurrency = max_concurrency
+        self.max_pixels = max_pixels
+        self._condition = threading.Condition()
+        self.running = 0
+        self.running_pixels = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+
+    @contextmanager
+    def admit(self, pixels: int, timeout: float) -> Iterator[None]:
+        '''
+        This function waits until a transform of an image with the given pixel count may run and holds its slot
+        until the with block exits. Raises RenderQueueFull after timeout seconds.
+        '''
+        pixels = min(pixels, self.max_pixels)
+        started = time.monotonic()
+        with self._condition:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            admitted = self._condition.wait_for(lambda: self._fits(pixels), timeout)
+            self.waiting -= 1
+            self.wait_time += time.monotonic() - started
+            if not admitted:
+                self.rejected += 1
+                raise RenderQueueFull()
+            self.admitted += 1
+            self.running += 1
+            self.running_pixels += pixels
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.running -= 1
+                self.running_pixels -= pixels
+                self._condition.notify_all()
+
+    def _fits(self, pixels: int) -> bool:
+        return (self.running < self.max_concurrency
+                and self.running_pixels + pixels <= self.max_pixels)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'running': self.running,
+                'running_pixels': self.running_pixels,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'wait_time_seconds': self.wait_time,
+                'max_concurrency': self.max_concurrency,
+                'max_pixels': self.max_pixels,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_render_limiter() -> RenderLimiter:
+    max_concurrency = settings.THUMBNAIL_RENDER_CONCURRENCY
+    max_pixels = settings.THUMBNAIL_RENDER_MAX_PIXELS
+    with _limiters_lock:
+        limiter = _limiters.get((max_concurrency, max_pixels))
+        if limiter is None:
+            limiter = _limiters[(max_concurrency, max_pixels)] = RenderLimiter(max_concurrency, max_pixels)
+    return limiter
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import threading
+import traceback
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ImageJob, UploadedImage
+from .thumbnails import ImageTooLarge, pregenerate_thumbnails
+
+
+def pregenerate_thumbnails_job(image_id: int, heights: List[int], encoding: Optional[dict] = None,
+                               max_pixels: Optional[int] = None, quality: Optional[int] = None) -> None:
+    # quality is accepted for jobs queued before encoding profiles existed.
+    image = UploadedImage.objects.filter(pk=image_id).first()
+    if image is None:
+        return
+    try:
+        pregenerate_thumbnails(image, heights, encoding or {'quality': quality}, max_pixels)
+    except ImageTooLarge:
+        # Retrying would not help; the thumbnails are refused when requested as well.
+        pass
+
+
+JOB_HANDLERS = {
+    'pregenerate_thumbnails': pregenerate_thumbnails_job,
+}
+
+
+def run_job(name: str, payload: dict) -> None:
+    '''
+    This function runs the handler registered for the job name. It is a module level function so it can be sent to worker processes.
+    '''
+    JOB_HANDLERS[name](**payload)
+
+
+class BaseJobQueue:
+    def enqueue(self, name: str, **payload) -> None:
+        raise NotImplementedError
+
+    def enqueue_many(self, name: str, payloads: List[dict]) -> None:
+        for payload in payloads:
+            self.enqueue(name, **payload)
+
+
+class ImmediateJobQueue(BaseJobQueue):
+    '''
+    Runs jobs synchronously inside the request, as if no queue was configured.
+    '''
+
+    def enqueue(self, name: str, **payload) -> None:
+        try:
+            run_job(name, payload)
+        except IOError:
+            pass
+
+
+class ThreadJobQueue(BaseJobQueue):
+    '''
+    Runs jobs on a thread pool of the current process once the surrounding transaction commits.
+    Jobs are lost if the process exits before they finish.
+    '''
+    _executor = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_JOB_THREADS, thread_name_prefix='image-jobs')
+            return cls._executor
+
+    def enqueue(self, name: str, **payload) -> None:
+        transaction.on_commit(
+            lambda: self.get_executor().submit(run_job, name, payload))
+
+
+class DatabaseJobQueue(BaseJobQueue):
+    '''
+    Stores jobs as ImageJob rows, consumed by the process_image_jobs management command.
+    '''
+
+    def enqueue(self, name: str, **payload) -> None:
+        ImageJob.objects.create(name=name, payload=payload)
+
+    def enqueue_many(self, name: str, payloads: List[dict]) -> None:
+        ImageJob.objects.bulk_create(
+            [ImageJob(name=name, payload=payload) for payload in payloads])
+
+    def claim(self, limit: int) -> List[ImageJob]:
+        '''
+        This function marks up to limit pending (or stale running) jobs as running and returns them.
+        Rows locked by other workers are skipped, so several workers can poll the same table.
+        '''
+        stale_before = timezone.now() - datetime.timedelta(seconds=settings.IMAGE_JOB_STALE_AFTER)
+        with transaction.atomic():
+            jobs = list(ImageJob.objects
+                        .select_for_update(skip_locked=True)
+                        .filter(Q(status=ImageJob.PENDING) | Q(status=ImageJob.RUNNING, updated_at__lt=stale_before))
+                        .order_by('id')[:limit])
+            ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=ImageJob.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now())
+        return jobs
+
+    def complete(self, job: ImageJob) -> None:
+        ImageJob.objects.filter(pk=job.pk).delete()
+
+    def fail(self, job: ImageJob, error: BaseException) -> None:
+        attempts = job.attempts + 1
+        job_status = ImageJob.FAILED if attempts >= settings.IMAGE_JOB_MAX_ATTEMPTS else ImageJob.PENDING
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=job_status,
+            error=''.join(traceback.format_exception(error)),
+            updated_at=timezone.now())
+
+
+def get_job_queue() -> BaseJobQueue:
+    return import_string(settings.IMAGE_JOB_QUEUE)()
+
+
+def enqueue_job(name: str, **payload) -> None:
+    get_job_queue().enqueue(name, **payload)
+
+
+def enqueue_jobs(name: str, payloads: List[dict]) -> None:
+    get_job_queue().enqueue_many(name, payloads)
@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+import fcntl
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .executors import RenderQueueFull
+
+# Seconds between attempts to take a lock held by another process.
+LOCK_POLL_INTERVAL = 0.05
+
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+
+@contextmanager
+def process_lock(key: str, timeout: Optional[float] = None) -> Iterator[None]:
+    '''
+    This function holds a lock shared by all threads of this process using the same key. Locks are created on
+    demand and dropped once nobody holds or waits for them. Raises RenderQueueFull when the lock is not
+    acquired within timeout seconds.
+    '''
+    with _process_locks_guard:
+        entry = _process_locks.get(key)
+        if entry is None:
+            entry = _process_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        if not entry[0].acquire(timeout=-1 if timeout is None else max(timeout, 0)):
+            raise RenderQueueFull()
+        try:
+            yield
+        finally:
+            entry[0].release()
+    finally:
+        with _process_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _process_locks[key]
+
+
+def poll_lock(try_acquire: Callable[[], bool], deadline: Optional[float]) -> None:
+    '''
+    This function calls try_acquire until it returns True, raising RenderQueueFull once the time.monotonic()
+    deadline has passed.
+    '''
+    while not try_acquire():
+        if deadline is not None and time.monotonic() >= deadline:
+            raise RenderQueueFull()
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def lock_deadline(timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else time.monotonic() + timeout
+
+
+class ProcessRenderLock:
+    '''
+    Makes concurrent renders of the same thumbnail within one process wait for a single render.
+    '''
+
+    def lock(self, key: str, timeout: Optional[float] = None):
+        '''
+        This function returns a context manager holding the lock of key, raising RenderQueueFull when it is not
+        acquired within timeout seconds.
+        '''
+        return process_lock(key, timeout)
+
+
+class FileRenderLock(ProcessRenderLock):
+    '''
+    Extends ProcessRenderLock across processes sharing the thumbnail cache directory with flock(). Keys are
+    spread over a fixed number of lock files, so unrelated renders rarely wait for each other and lock files
+    never need to be cleaned up.
+    '''
+    STRIPES_PREFIX_LENGTH = 3
+
+    @contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[None]:
+        deadline = lock_deadline(timeout)
+        with process_lock(key, timeout):
+            directory = os.path.join(settings.MEDIA_ROOT, settings.THUMBNAIL_CACHE_DIR, 'locks')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, key[:self.STRIPES_PREFIX_LENGTH] + '.lock')
+            with open(path, 'a') as lock_file:
+                if deadline is None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                else:
+                    poll_lock(lambda: self._try_flock(lock_file), deadline)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _try_flock(lock_file) -> bool:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+
+class DatabaseRenderLock(ProcessRenderLock):
+    '''
+    Extends ProcessRenderLock across hosts with a PostgreSQL session-level advisory lock on the database
+    connection of the current thread. Falls back to the process lock on other databases.
+    '''
+
+    @contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[None]:
+        deadline = lock_deadline(timeout)
+        with process_lock(key, timeout):
+            if connection.vendor != 'postgresql':
+                yield
+                return
+            lock_id = int(key[:16], 16) - 2 ** 63
+            if deadline is None:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_lock(%s)', [lock_id])
+            else:
+                poll_lock(lambda: self._try_advisory_lock(lock_id), deadline)
+            try:
+                yield
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
+
+    @staticmethod
+    def _try_advisory_lock(lock_id: int) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+            return cursor.fetchone()[0]
+
+
+def get_render_lock() -> ProcessRenderLock:
+    return import_string(settings.THUMBNAIL_RENDER_LOCK)()
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from image_uploader.benchmarks import BENCHMARKS, compare, environment
+
+
+def comma_separated(value: str) -> list:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks and prints the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*',
+                            help=f'Suites to run, all by default. Available: {", ".join(BENCHMARKS)}.')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Measured iterations per benchmark.')
+        parser.add_argument('--sizes', type=lambda value: [int(size) for size in comma_separated(value)],
+                            default=[256, 1024, 2048], help='Comma separated widths of the synthetic images.')
+        parser.add_argument('--formats', type=comma_separated, default=['jpeg', 'png'],
+                            help='Comma separated formats of the synthetic images.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='Relative p50 latency increase reported as a regression.')
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or list(BENCHMARKS)
+        unknown = set(suites) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmark suites: {", ".join(sorted(unknown))}')
+
+        results = {}
+        for suite in suites:
+            self.stderr.write(f'Running {suite} benchmarks...')
+            results[suite] = BENCHMARKS[suite](options)
+        report = {'environment': environment(), 'results': results}
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                regressions = compare(results, json.load(file), options['threshold'])
+            for regression in regressions:
+                self.stderr.write(f'Regression: {regression}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} benchmark(s) regressed')
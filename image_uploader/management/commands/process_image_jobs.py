@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+import time
+
+import django
+from django.core.management.base import BaseCommand
+
+from image_uploader.jobs import DatabaseJobQueue, run_job
+
+
+class Command(BaseCommand):
+    help = 'Processes queued image jobs (e.g. thumbnail pre-generation) on a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes. 0 runs jobs in this process.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of jobs claimed at once. Defaults to twice the number of workers.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before polling again when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling for new jobs.')
+
+    def handle(self, *args, **options):
+        queue = DatabaseJobQueue()
+        workers = options['workers']
+        batch_size = options['batch_size'] or max(workers, 1) * 2
+
+        if workers == 0:
+            self.process(queue, None, batch_size, options)
+            return
+        # Workers are spawned rather than forked so they never share this process' database connection.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            self.process(queue, pool, batch_size, options)
+
+    def process(self, queue: DatabaseJobQueue, pool, batch_size: int, options: dict) -> None:
+        while True:
+            jobs = queue.claim(batch_size)
+            if not jobs:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            if pool is None:
+                for job in jobs:
+                    try:
+                        run_job(job.name, job.payload)
+                    except Exception as e:
+                        self.finish(queue, job, e)
+                    else:
+                        self.finish(queue, job, None)
+                continue
+
+            futures = {pool.submit(run_job, job.name, job.payload): job for job in jobs}
+            for future in as_completed(futures):
+                self.finish(queue, futures[future], future.exception())
+
+    def finish(self, queue: DatabaseJobQueue, job, error) -> None:
+        if error is None:
+            queue.complete(job)
+            self.stdout.write(f'Finished job {job.pk} ({job.name})')
+        else:
+            queue.fail(job, error)
+            self.stderr.write(f'Job {job.pk} ({job.name}) failed: {error!r}')
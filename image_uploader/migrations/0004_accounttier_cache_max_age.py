@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0003_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(default=3600, help_text='Seconds clients may cache images without revalidating.'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0004_accounttier_cache_max_age'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(fields=['user', 'id'], name='image_uploa_user_id_287dc4_idx'),
+        ),
+    ]
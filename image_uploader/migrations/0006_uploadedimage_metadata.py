@@ -0,0 +1,84 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.utils.timezone
+import hashlib
+import PIL.Image
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def read_image_metadata(file):
+    # A copy of image_uploader.utils.read_image_metadata as of this migration, so later changes to it do not
+    # change what the migration does.
+    digest = hashlib.sha256()
+    file_size = 0
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        file_size += len(chunk)
+    file.seek(0)
+    with PIL.Image.open(file) as image:
+        width, height = image.size
+        image_format = image.format
+    return {
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'file_size': file_size,
+        'content_hash': digest.hexdigest(),
+    }
+
+
+def populate_image_metadata(apps, schema_editor):
+    UploadedImage = apps.get_model('image_uploader', 'UploadedImage')
+    storage = UploadedImage._meta.get_field('image').storage
+    for image in UploadedImage.objects.filter(content_hash='').iterator():
+        try:
+            with storage.open(image.image.name) as file:
+                metadata = read_image_metadata(file)
+            metadata['uploaded_at'] = storage.get_modified_time(image.image.name)
+        except (OSError, SyntaxError, ValueError, PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError):
+            # Unreadable files are skipped; their metadata is filled in when the image is next saved.
+            continue
+        UploadedImage.objects.filter(pk=image.pk).update(**metadata)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0005_uploadedimage_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='format',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='uploaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_image_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:43
+
+from django.db import migrations, models
+import os
+
+
+def populate_image_names(apps, schema_editor):
+    UploadedImage = apps.get_model('image_uploader', 'UploadedImage')
+    for image in UploadedImage.objects.filter(name='').only('id', 'image').iterator():
+        UploadedImage.objects.filter(pk=image.pk).update(name=os.path.basename(image.image.name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0006_uploadedimage_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='name',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_image_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='uploadedimage',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_image_name_per_user'),
+        ),
+    ]
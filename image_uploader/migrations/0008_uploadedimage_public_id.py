@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:46
+
+from django.db import migrations, models
+import image_uploader.models
+
+
+def populate_public_ids(apps, schema_editor):
+    UploadedImage = apps.get_model('image_uploader', 'UploadedImage')
+    for image in UploadedImage.objects.filter(public_id__isnull=True).only('id').iterator():
+        UploadedImage.objects.filter(pk=image.pk).update(public_id=image_uploader.models.generate_public_id())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0007_uploadedimage_name'),
+    ]
+
+    operations = [
+        # Added as nullable first so every existing row gets its own id instead of one shared default.
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='public_id',
+            field=models.CharField(editable=False, max_length=22, null=True),
+        ),
+        migrations.RunPython(populate_public_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='public_id',
+            field=models.CharField(default=image_uploader.models.generate_public_id, editable=False, max_length=22),
+        ),
+        migrations.AddConstraint(
+            model_name='uploadedimage',
+            constraint=models.UniqueConstraint(fields=('user', 'public_id'), name='unique_image_public_id_per_user'),
+        ),
+    ]
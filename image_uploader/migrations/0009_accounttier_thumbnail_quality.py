@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:53
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0008_uploadedimage_public_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='thumbnail_quality',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Encoder quality of JPEG, WebP and AVIF thumbnails. Empty uses the server default.', null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
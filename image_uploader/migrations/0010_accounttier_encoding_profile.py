@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0009_accounttier_thumbnail_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='encoding_profile',
+            field=models.CharField(blank=True, help_text='Name of a THUMBNAIL_ENCODING_PROFILES entry. Empty uses THUMBNAIL_DEFAULT_ENCODING_PROFILE.', max_length=32),
+        ),
+    ]
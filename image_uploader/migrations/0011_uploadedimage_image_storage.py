@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:59
+
+from django.db import migrations, models
+import image_uploader.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0010_accounttier_encoding_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='image',
+            field=models.ImageField(storage=image_uploader.storage.get_image_storage, upload_to='images/'),
+        ),
+    ]
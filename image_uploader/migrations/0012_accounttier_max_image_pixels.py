@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_uploader', '0011_uploadedimage_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='max_image_pixels',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Largest original (width x height) thumbnails are rendered from. Empty uses THUMBNAIL_MAX_IMAGE_PIXELS.', null=True),
+        ),
+    ]
@@ -1,32 +1,155 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.files import File
 import PIL.Image
 import os
+import secrets
+from django.utils import timezone
+from .utils import image_format_from_name, read_image_metadata
+from .responses import make_etag
+from .blobs import blob_name, store_blob
+from .storage import get_image_storage
+from typing import BinaryIO, Optional, Set
+import datetime
 
 User = settings.AUTH_USER_MODEL
 
 
+# 8 random bytes give 11 character URL-safe ids.
+PUBLIC_ID_BYTES = 8
+
+
+def generate_public_id() -> str:
+    return secrets.token_urlsafe(PUBLIC_ID_BYTES)
+
+
 class UploadedImage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='images/')
+    public_id = models.CharField(max_length=22, default=generate_public_id, editable=False)
+    name = models.CharField(max_length=100)
+    image = models.ImageField(upload_to='images/', storage=get_image_storage)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    format = models.CharField(max_length=16, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    uploaded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'id'])]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_image_name_per_user'),
+            models.UniqueConstraint(fields=['user', 'public_id'], name='unique_image_public_id_per_user'),
+        ]
 
     def __str__(self) -> str:
         return self.image.name
 
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            # The blob is locked until the row referencing it is committed (see lock_blob).
+            with transaction.atomic():
+                self.store_file(self.image.file, self.image.name)
+                super().save(*args, **kwargs)
+            return
+        if self.image and not self.content_hash:
+            self.populate_metadata()
+        super().save(*args, **kwargs)
+
+    def store_file(self, file: BinaryIO, file_name: str, taken_names: Set[str] = frozenset()) -> None:
+        '''
+        This function stores file in the content-addressed blob store and names the image after file_name.
+        Files with the same content share one blob (and its cached thumbnails), whoever uploaded them. Has to be
+        called in the transaction that saves the image.
+        '''
+        if not self.content_hash:
+            self.populate_metadata(file)
+        if not self.name:
+            self.name = self.get_available_name(file_name, taken_names)
+        field = self._meta.get_field('image')
+        self.image = store_blob(field.storage, blob_name(field.upload_to, self.content_hash, self.format), file)
+
+    def get_available_name(self, file_name: str, taken_names: Set[str] = frozenset()) -> str:
+        '''
+        This function returns file_name, made unique among the user's images (and taken_names) the same way
+        storages rename clashing files.
+        '''
+        storage = self._meta.get_field('image').storage
+        name = storage.get_valid_name(os.path.basename(file_name))
+        root, ext = os.path.splitext(name)
+        max_length = self._meta.get_field('name').max_length
+        root = root[:max_length - len(ext) - 8]
+        name = root + ext
+        while name in taken_names or UploadedImage.objects.filter(user=self.user_id, name=name).exists():
+            name = storage.get_alternative_name(root, ext)
+        return name
+
+    def populate_metadata(self, file: Optional[BinaryIO] = None) -> None:
+        '''
+        This function stores the dimensions, format, size and content hash of the image file (or of file, when
+        it is given before the image is saved to storage), so serving the image does not need to open it.
+        '''
+        if file is not None:
+            metadata = read_image_metadata(file)
+        elif self.image._committed:
+            with self.open_image() as stored_file:
+                metadata = read_image_metadata(stored_file)
+        else:
+            metadata = read_image_metadata(self.image.file)
+        for field_name, value in metadata.items():
+            setattr(self, field_name, value)
+
     def get_image_file(self) -> PIL.Image:
-        img = PIL.Image.open(self.image.path)
+        '''
+        This function opens the image for decoding. Files of storages with local paths are opened by path;
+        otherwise the file is opened through the storage API and closed together with the image.
+        '''
+        try:
+            return PIL.Image.open(self.image.path)
+        except NotImplementedError:
+            pass
+        file = self.open_image()
+        try:
+            img = PIL.Image.open(file)
+        except BaseException:
+            file.close()
+            raise
+        # Let Pillow close the storage file after loading and on close(), as it does for files it opened itself.
+        img._exclusive_fp = True
         return img
 
+    def open_image(self, mode: str = 'rb') -> File:
+        return self.image.storage.open(self.image.name, mode)
+
+    def get_modified_time(self) -> datetime.datetime:
+        return self.uploaded_at
+
+    @property
+    def etag(self) -> str:
+        if self.content_hash:
+            return make_etag(self.content_hash)
+        return make_etag(self.image.name, self.image.size, self.image.storage.get_modified_time(self.image.name))
+
+    @property
+    def image_format(self) -> str:
+        if self.format:
+            return self.format
+        image_format = image_format_from_name(self.image.name)
+        if image_format is None:
+            with self.get_image_file() as image_pil:
+                image_format = image_pil.format
+        return image_format
+
     @property
     def image_url(self) -> str:
         return self.image.url
 
     @property
     def image_name(self) -> str:
-        return os.path.basename(self.image.name)
+        return self.name or os.path.basename(self.image.name)
 
 
 class AccountTier(models.Model):
@@ -40,6 +163,26 @@ class AccountTier(models.Model):
         ), default=list, blank=True)
     access_to_original_image = models.BooleanField(default=False)
     expiring_link_creation = models.BooleanField(default=False)
+    cache_max_age = models.PositiveIntegerField(
+        default=3600, help_text='Seconds clients may cache images without revalidating.')
+    thumbnail_quality = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text='Encoder quality of JPEG, WebP and AVIF thumbnails. Empty uses the server default.')
+    max_image_pixels = models.PositiveBigIntegerField(
+        null=True, blank=True,
+        help_text='Largest original (width x height) thumbnails are rendered from. '
+                  'Empty uses THUMBNAIL_MAX_IMAGE_PIXELS.')
+    encoding_profile = models.CharField(
+        max_length=32, blank=True,
+        help_text='Name of a THUMBNAIL_ENCODING_PROFILES entry. Empty uses THUMBNAIL_DEFAULT_ENCODING_PROFILE.')
+
+    @property
+    def encoding(self) -> dict:
+        return {'profile': self.encoding_profile, 'quality': self.thumbnail_quality}
+
+    @property
+    def image_pixel_limit(self) -> int:
+        return self.max_image_pixels or settings.THUMBNAIL_MAX_IMAGE_PIXELS
 
     def __str__(self) -> str:
         return self.name
@@ -51,3 +194,29 @@ class User(AbstractUser):
 
     def __str__(self) -> str:
         return self.username
+
+
+class ImageJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,33 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class ImageCursorPagination(CursorPagination):
+    '''
+    Keyset pagination of a user's images ordered by id. Each page is a single index range scan on
+    (user, id), so its cost does not depend on how many images the user has.
+
+    The response body keeps the {image name: urls} shape of the unpaginated list; links to the
+    neighbouring pages are sent in the Link header.
+    '''
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        self.page_size = settings.IMAGE_LIST_PAGE_SIZE
+        self.max_page_size = settings.IMAGE_LIST_MAX_PAGE_SIZE
+        return super().get_page_size(request)
+
+    def get_paginated_response(self, data):
+        response = Response(data)
+        links = []
+        next_link = self.get_next_link()
+        if next_link:
+            links.append(f'<{next_link}>; rel="next"')
+        previous_link = self.get_previous_link()
+        if previous_link:
+            links.append(f'<{previous_link}>; rel="prev"')
+        if links:
+            response['Link'] = ', '.join(links)
+        return response
@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import Executor
+from typing import BinaryIO, Callable, Optional
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+SENDFILE_BACKENDS = ('x-accel-redirect', 'x-sendfile')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = FileResponse.block_size
+
+
+def file_response(file: BinaryIO, content_type: str) -> HttpResponse:
+    '''
+    This function returns a response sending the content of an open file.
+
+    By default the file is streamed in chunks by FileResponse, which lets the WSGI server use
+    wsgi.file_wrapper (sendfile) when it provides one. With IMAGE_SENDFILE_BACKEND set, a file on the
+    local disk under MEDIA_ROOT is closed and only a header is returned, leaving the transfer to the
+    fronting proxy; files of other storages are still streamed.
+    '''
+    backend = settings.IMAGE_SENDFILE_BACKEND
+    path = local_file_path(file)
+    if not backend or path is None:
+        return FileResponse(file, content_type=content_type)
+    if backend not in SENDFILE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'IMAGE_SENDFILE_BACKEND must be one of {SENDFILE_BACKENDS}, not {backend!r}')
+
+    file.close()
+    response = HttpResponse(content_type=content_type)
+    if backend == 'x-accel-redirect':
+        relative_path = os.path.relpath(path, os.path.abspath(settings.MEDIA_ROOT))
+        response['X-Accel-Redirect'] = settings.IMAGE_SENDFILE_URL + quote(relative_path.replace(os.sep, '/'))
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def local_file_path(file: BinaryIO) -> Optional[str]:
+    '''
+    This function returns the absolute path of an open file when it is a file on the local disk, such as the
+    files of FileSystemStorage (wrapped in django.core.files.File) or of the thumbnail cache, and None otherwise.
+    '''
+    raw_file = getattr(file, 'file', file)
+    if not isinstance(raw_file, (io.BufferedReader, io.FileIO)) or not isinstance(raw_file.name, str):
+        return None
+    return os.path.abspath(raw_file.name)
+
+
+def make_etag(*parts) -> str:
+    '''
+    This function returns a strong ETag built from values identifying a representation.
+    '''
+    return quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+
+
+def conditional_file_response(request, open_file: Callable[[], BinaryIO], content_type: str,
+                              etag: str, last_modified: datetime.datetime, max_age: int,
+                              allow_ranges: bool = False) -> HttpResponse:
+    '''
+    This function returns a response for a file identified by etag and last_modified.
+
+    Requests with matching If-None-Match/If-Modified-Since headers get a 304 without the file being
+    opened. With allow_ranges, a single "Range: bytes=..." request is answered with a 206 partial response.
+    '''
+    last_modified_timestamp = int(last_modified.timestamp())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified_timestamp)
+    if response is None:
+        file = open_file()
+        if allow_ranges and not (settings.IMAGE_SENDFILE_BACKEND and local_file_path(file)):
+            response = range_file_response(request, file, content_type, etag, last_modified_timestamp)
+        if response is None:
+            response = file_response(file, content_type)
+        if allow_ranges:
+            response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified_timestamp)
+    patch_cache_control(response, private=True, max_age=max_age)
+    return response
+
+
+async def conditional_file_response_async(request, open_file: Callable[[], BinaryIO], content_type: str,
+                                          etag: str, last_modified: datetime.datetime, max_age: int,
+                                          allow_ranges: bool = False, executor: Optional[Executor] = None) -> HttpResponse:
+    '''
+    This function is the async variant of conditional_file_response. The file is opened and read into memory on
+    executor (the loop's default executor when None), so the event loop does not block on disk: Django 4.1
+    iterates streaming response bodies synchronously under ASGI and cannot consume an async iterator. Files
+    larger than ASYNC_IMAGE_BUFFER_MAX_SIZE are not buffered; they are returned as a regular FileResponse whose
+    chunks Django's ASGI handler reads synchronously, so such a download still ties up a thread until it is sent.
+    Nothing is memory-mapped. With a sendfile backend only the path of a local file is needed and nothing is read.
+    '''
+    def open_buffered() -> BinaryIO:
+        file = open_file()
+        if settings.IMAGE_SENDFILE_BACKEND and local_file_path(file):
+            return file
+        size = file.seek(0, io.SEEK_END)
+        file.seek(0)
+        if size > settings.ASYNC_IMAGE_BUFFER_MAX_SIZE:
+            return file
+        with file:
+            return io.BytesIO(file.read())
+
+    last_modified_timestamp = int(last_modified.timestamp())
+    if get_conditional_response(request, etag=etag, last_modified=last_modified_timestamp) is None:
+        loop = asyncio.get_running_loop()
+        file = await loop.run_in_executor(executor, open_buffered)
+        open_file = lambda: file  # noqa: E731
+    return conditional_file_response(
+        request, open_file, content_type, etag, last_modified, max_age, allow_ranges)
+
+
+def range_file_response(request, file: BinaryIO, content_type: str, etag: str,
+                        last_modified: int) -> Optional[HttpResponse]:
+    '''
+    This function returns a 206 (or 416) response for the Range header of the request, or None when
+    the whole file should be sent instead. Multiple ranges are not supported and get the whole file.
+    '''
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').replace(' ', ''))
+    if match is None or request.method != 'GET' or not if_range_passes(request, etag, last_modified):
+        return None
+
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        # A range ending before it starts is invalid, so the header is ignored.
+        return None
+    size = file.seek(0, io.SEEK_END)
+    file.seek(0)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+    if start > end:
+        # Starts past the end, a zero-length suffix or an empty file.
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file.seek(start)
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        RangeFileWrapper(file, length), status=206, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def if_range_passes(request, etag: str, last_modified: int) -> bool:
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+class RangeFileWrapper:
+    '''
+    Iterates over the next length bytes of a file in chunks and closes it afterwards.
+    '''
+
+    def __init__(self, file: BinaryIO, length: int):
+        self.file = file
+        self.remaining = length
+
+    def __iter__(self):
+        while self.remaining > 0:
+            data = self.file.read(min(CHUNK_SIZE, self.remaining))
+            if not data:
+                break
+            self.remaining -= len(data)
+            yield data
+
+    def close(self):
+        self.file.close()
@@ -2,10 +2,28 @@ from rest_framework import serializers
 from .models import UploadedImage
 from django.core.exceptions import ValidationError
 from django.conf import settings
-import os
+from django.db import models
+from .validators import validate_image_header
+
+
+class HeaderValidatedImageField(serializers.ImageField):
+    '''
+    ImageField checking the magic bytes and header of an upload (see validate_image_header) before Pillow opens
+    and verifies the whole file.
+    '''
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'read') and hasattr(data, 'seek'):
+            validate_image_header(data)
+        return super().to_internal_value(data)
 
 
 class UploadedImageSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: HeaderValidatedImageField,
+    }
+
     class Meta:
         model = UploadedImage
         fields = ('image', 'image_url')
@@ -28,11 +46,11 @@ class UploadedImageSerializer(serializers.ModelSerializer):
         if not image:
             raise ValidationError("Image file is missing")
         filesize = image.size
-        megabyte_limit = 2.0
+        megabyte_limit = settings.IMAGE_MAX_UPLOAD_SIZE / 1024 / 1024
         if filesize > megabyte_limit*1024*1024:
             raise ValidationError(f"Maximum file size is {megabyte_limit} MB")
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['image'] = os.path.basename(representation['image_url'])
+        representation['image'] = instance.image_name
         return representation
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .blobs import release_blob
+from .models import AccountTier, UploadedImage, User
+
+
+@receiver(post_delete, sender=UploadedImage)
+def release_image_blob(sender, instance: UploadedImage, **kwargs) -> None:
+    if instance.image:
+        storage, name, content_hash = instance.image.storage, instance.image.name, instance.content_hash
+        transaction.on_commit(lambda: release_blob(storage, name, content_hash))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance: Token, **kwargs) -> None:
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance: User, **kwargs) -> None:
+    invalidate_tokens(Token.objects.filter(user=instance.pk).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=AccountTier)
+def invalidate_tier_tokens(sender, instance: AccountTier, **kwargs) -> None:
+    invalidate_tokens(Token.objects.filter(user__tier=instance.pk).values_list('key', flat=True))
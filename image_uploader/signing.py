@@ -0,0 +1,88 @@
+import datetime
+from functools import lru_cache
+import hashlib
+import hmac
+import time
+from typing import Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.signing import BadSignature, Signer, b64_encode
+from django.urls import Resolver404, resolve, reverse
+from django.utils.encoding import force_bytes
+
+from .tokens import ExpiredToken, ExpiringLink, InvalidToken, make_token, read_token
+
+
+class BatchSigner(Signer):
+    '''
+    Signer producing exactly the signatures of django.core.signing.Signer with the same key, for signing many
+    values in a row. Signer derives the salted HMAC key from the secret on every call; here it is derived once
+    and every signature continues from a copy of the keyed HMAC state.
+    '''
+
+    def __init__(self, key=None, sep=':', salt=None, algorithm=None, fallback_keys=None):
+        # Default to Signer's salt, so the signatures verify with a plain Signer().
+        super().__init__(key=key, sep=sep, salt=salt or 'django.core.signing.Signer',
+                         algorithm=algorithm, fallback_keys=fallback_keys)
+        hasher = getattr(hashlib, self.algorithm)
+        derived_key = hasher(force_bytes(self.salt + 'signer') + force_bytes(self.key)).digest()
+        self._hmac = hmac.new(derived_key, digestmod=hasher)
+
+    def signature(self, value, key=None):
+        if key is not None and key != self.key:
+            return super().signature(value, key)
+        signature = self._hmac.copy()
+        signature.update(force_bytes(value))
+        return b64_encode(signature.digest()).decode()
+
+
+def sign_expiring_link(image_id: int, height: Optional[int], expires_at: datetime.datetime) -> str:
+    '''
+    This function returns the path of the expiring link to the image (or its thumbnail with the given height)
+    valid until expires_at.
+    '''
+    return reverse('use_expiring_url') + '?signature=' + make_token(image_id, height, int(expires_at.timestamp()))
+
+
+def read_expiring_link(signature: str) -> ExpiringLink:
+    '''
+    This function returns the link granted by the signature parameter of an expiring link: a compact token (see
+    tokens.make_token) or, for links created before those, a Signer-signed JSON object, told apart by the ":"
+    separating Signer's signature. The oldest of those hold an image view URL (see _read_url_link). Raises
+    InvalidToken, or ExpiredToken for expired links.
+    '''
+    if ':' not in signature:
+        return read_token(signature)
+    try:
+        signed_data = _legacy_signer(settings.SECRET_KEY, tuple(settings.SECRET_KEY_FALLBACKS)).unsign_object(signature)
+        expires_at = datetime.datetime.fromisoformat(signed_data['expires_at']).timestamp()
+        if expires_at < time.time():
+            raise ExpiredToken('Link has expired')
+        if 'url' in signed_data:
+            return _read_url_link(signed_data['url'], expires_at)
+        return ExpiringLink(int(signed_data['image']), signed_data['height'], expires_at)
+    except (KeyError, TypeError, ValueError, BadSignature) as error:
+        raise InvalidToken(str(error)) from error
+
+
+def _read_url_link(url: str, expires_at: float) -> ExpiringLink:
+    '''
+    This function returns the link of a signed image view URL, which is how links were signed before images
+    were served in-process. Those URLs name the image by its file name among the images of the user requesting
+    it, so the returned link has a path instead of an image id.
+    '''
+    try:
+        match = resolve(unquote(urlsplit(url).path))
+    except Resolver404:
+        raise InvalidToken('Unknown image URL')
+    if match.url_name == 'get_image':
+        return ExpiringLink(None, None, expires_at, match.kwargs['path'])
+    if match.url_name == 'get_thumbnail':
+        return ExpiringLink(None, match.kwargs['height'], expires_at, match.kwargs['path'])
+    raise InvalidToken('Unknown image URL')
+
+
+@lru_cache(maxsize=None)
+def _legacy_signer(key: str, fallback_keys: Tuple[str, ...]) -> Signer:
+    return BatchSigner(key=key, fallback_keys=list(fallback_keys))
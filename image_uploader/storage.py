@@ -0,0 +1,127 @@
+import datetime
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Tuple
+from urllib.parse import quote, unquote, urljoin
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+
+
+class ImageStorage(LazyObject):
+    '''
+    The storage of uploaded images, an instance of IMAGE_STORAGE created with IMAGE_STORAGE_OPTIONS on first use.
+    '''
+
+    def _setup(self):
+        self._wrapped = import_string(settings.IMAGE_STORAGE)(**settings.IMAGE_STORAGE_OPTIONS)
+
+
+image_storage = ImageStorage()
+
+
+def get_image_storage() -> Storage:
+    return image_storage
+
+
+@receiver(setting_changed)
+def reset_image_storage(setting: str, **kwargs) -> None:
+    if setting in ('IMAGE_STORAGE', 'IMAGE_STORAGE_OPTIONS'):
+        image_storage._wrapped = empty
+
+
+@deconstructible
+class LocalObjectStorage(Storage):
+    '''
+    Stand-in for an S3-compatible object store, keeping objects in a single local directory (by default
+    <MEDIA_ROOT>/objects) so code paths that cannot rely on local files can be run and tested without a bucket.
+
+    Like a bucket it has a flat key space ("/" in a key does not create directories) and no local paths, so
+    path() raises NotImplementedError. Objects are written whole, saving to an existing key overwrites it, and
+    opening an object returns a downloaded copy rather than the stored file.
+    '''
+
+    def __init__(self, location: Optional[str] = None, base_url: Optional[str] = None):
+        self._location = location
+        self._base_url = base_url
+
+    @property
+    def location(self) -> str:
+        return os.path.abspath(self._location or os.path.join(settings.MEDIA_ROOT, 'objects'))
+
+    @property
+    def base_url(self) -> str:
+        return self._base_url or settings.MEDIA_URL
+
+    def _object_path(self, name: str) -> str:
+        return os.path.join(self.location, quote(name, safe=''))
+
+    def _open(self, name: str, mode: str = 'rb') -> File:
+        if set(mode) & set('wax+'):
+            raise ValueError('Objects can only be opened for reading, use save() to write them')
+        download = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        with open(self._object_path(name), 'rb') as stored:
+            shutil.copyfileobj(stored, download)
+        download.seek(0)
+        return File(download, name=name)
+
+    def _save(self, name: str, content: File) -> str:
+        os.makedirs(self.location, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    temporary_file.write(chunk)
+            os.replace(temporary_path, self._object_path(name))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return name
+
+    def get_available_name(self, name: str, max_length: Optional[int] = None) -> str:
+        return name
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(self._object_path(name))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._object_path(name))
+
+    def listdir(self, path: str) -> Tuple[List[str], List[str]]:
+        '''
+        This function lists the keys under the path prefix like a delimited bucket listing: the next key segment
+        of deeper keys as directories, the rest as files.
+        '''
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = set(), []
+        if os.path.isdir(self.location):
+            for entry in os.listdir(self.location):
+                key = unquote(entry)
+                if entry.startswith('.upload-') or not key.startswith(prefix):
+                    continue
+                segment, separator, _ = key[len(prefix):].partition('/')
+                if separator:
+                    directories.add(segment)
+                else:
+                    files.append(segment)
+        return sorted(directories), sorted(files)
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(self._object_path(name))
+
+    def url(self, name: str) -> str:
+        return urljoin(self.base_url, quote(name))
+
+    def get_modified_time(self, name: str) -> datetime.datetime:
+        timestamp = os.path.getmtime(self._object_path(name))
+        return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc if settings.USE_TZ else None)
@@ -1,3 +1,4 @@
+import importlib
 import tempfile
 import os
 import io
@@ -10,14 +11,38 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
-from .models import AccountTier
-from django.test import RequestFactory
-from .utils import create_image_url_dict
+from .models import AccountTier, ImageJob, UploadedImage
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from .utils import create_image_url_dict, read_image_metadata, resize_image_by_height, ImageURLBuilder
+from .validators import read_image_header, validate_image_header
+from .thumbnails import (ImageTooLarge, ThumbnailCache, get_encoder_options, get_thumbnail, get_thumbnail_cache,
+                         get_thumbnail_key, render_thumbnail, negotiate_output_format, pregenerate_thumbnails,
+                         save_thumbnail)
+from .jobs import DatabaseJobQueue, pregenerate_thumbnails_job
+from .executors import RenderLimiter, RenderQueueFull, get_render_limiter
+from .benchmarks import compare
+from .signing import BatchSigner
+from .tokens import TOKEN_LENGTH, ExpiredToken, ExpiringLink, InvalidToken, make_token, read_token
+from .async_views import get_image_executor
+from .blobs import store_blob
+from .responses import range_file_response
+from .storage import LocalObjectStorage
+from django.core.management import call_command
+from django.apps import apps as django_apps
+from django.db import connection
 from django.core.signing import Signer
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.test import override_settings
 import shutil
+import threading
+import time
+import hashlib
+import struct
+import zipfile
+import json
+from unittest import mock
 import rest_framework.test
 import xmlrunner
 
@@ -110,6 +135,26 @@ class ImageUploadViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(response.json(), response_json)
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_upload_stores_metadata(self):
+        self.client.force_authenticate(user=self.user_original)
+        data = self.valid_image.read()
+        self.valid_image.seek(0)
+        response = self.client.post(self.url, {'image': self.valid_image})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = self.user_original.uploadedimage_set.get()
+        self.assertEqual((image.width, image.height, image.format), (100, 100, 'PNG'))
+        self.assertEqual(image.file_size, len(data))
+        self.assertEqual(image.content_hash, hashlib.sha256(data).hexdigest())
+
+        with mock.patch('PIL.Image.open') as image_open, \
+                mock.patch('django.core.files.storage.FileSystemStorage.get_modified_time') as get_modified_time:
+            response = self.client.get(reverse('get_image', kwargs={'path': image.image_name}),
+                                       HTTP_IF_NONE_MATCH=image.etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        image_open.assert_not_called()
+        get_modified_time.assert_not_called()
+
     def test_upload_no_image(self):
         self.client.force_authenticate(user=self.user_empty_tier)
         response = self.client.post(self.url, {})
@@ -135,6 +180,19 @@ class ImageUploadViewTestCase(APITestCase):
                          [0], 'Maximum file size is 2.0 MB')
         oversized_image.close()
 
+    def test_upload_oversized_dimensions_rejected_from_header(self):
+        self.client.force_authenticate(user=self.user_empty_tier)
+        # A PNG header declaring 100000x100000 pixels, without any image data.
+        ihdr = struct.pack('>IIBBBBB', 100000, 100000, 8, 2, 0, 0, 0)
+        header = io.BytesIO(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + b'\0' * 4)
+        header.name = 'bomb.png'
+        with mock.patch('PIL.Image.open') as image_open:
+            response = self.client.post(self.url, {'image': header})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['image'][0],
+                         f'Maximum image size is {settings.IMAGE_MAX_UPLOAD_PIXELS} pixels')
+        image_open.assert_not_called()
+
     def test_upload_unauthenticated(self):
         response = self.client.post(self.url, {'image': self.valid_image})
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -145,6 +203,449 @@ class ImageUploadViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class BatchImageUploadViewTestCase(APITestCase):
+
+    def setUp(self):
+        self.url = reverse('image_batch_upload')
+        tier = AccountTier.objects.create(
+            name='test_tier_batch', thumbnail_heights=[100], access_to_original_image=True)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_batch', password='testpassword', tier=tier)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def generate_image(self, name, image_format='PNG'):
+        output = io.BytesIO()
+        Image.new('RGB', (100, 100), color='red').save(output, format=image_format)
+        output.seek(0)
+        output.name = name
+        return output
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_upload_multiple_images(self):
+        invalid_image = io.BytesIO(b'not an image')
+        invalid_image.name = 'invalid.png'
+        response = self.client.post(self.url, {'images': [
+            self.generate_image('first.png'), invalid_image, self.generate_image('second.jpg', 'JPEG')]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(response.data['images']), ['first.png', 'second.jpg'])
+        self.assertEqual(response.data['rejected'], [
+            {'file': 'invalid.png', 'error': 'Only JPEG and PNG images are supported'}])
+        self.assertEqual(self.user.uploadedimage_set.count(), 2)
+        self.assertEqual(ImageJob.objects.count(), 2)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_upload_zip_archive(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('photos/archived.png', self.generate_image('archived.png').getvalue())
+            zip_file.writestr('photos/notes.txt', b'not an image')
+            zip_file.writestr('__MACOSX/photos/._archived.png', b'')
+        archive.seek(0)
+        archive.name = 'photos.zip'
+        response = self.client.post(self.url, {'archive': archive})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(response.data['images']), ['archived.png'])
+        self.assertEqual(response.data['rejected'], [
+            {'file': 'photos/notes.txt', 'error': 'Only JPEG and PNG images are supported'}])
+
+        response = self.client.get(reverse('get_image', kwargs={'path': 'archived.png'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_upload_unreadable_image(self):
+        image = io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+        image.name = 'broken.png'
+        response = self.client.post(self.url, {'images': [image, self.generate_image('valid.png')]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(response.data['images']), ['valid.png'])
+        self.assertEqual(response.data['rejected'], [{'file': 'broken.png', 'error': 'Unable to read image file'}])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), IMAGE_MAX_UPLOAD_SIZE=1024)
+    def test_upload_too_large_image(self):
+        image = io.BytesIO(b'\x89PNG\r\n\x1a\n' + os.urandom(4096))
+        image.name = 'large.png'
+        response = self.client.post(self.url, {'images': [image]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['rejected'][0]['file'], 'large.png')
+        self.assertEqual(self.user.uploadedimage_set.count(), 0)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_names_taken_concurrently(self):
+        response = self.client.post(self.url, {'images': [self.generate_image('taken.png')]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        get_available_name = UploadedImage.get_available_name
+        calls = []
+
+        def stale_name(image, file_name, taken_names=frozenset()):
+            # The first pick misses the image a concurrent batch inserted meanwhile.
+            calls.append(file_name)
+            if len(calls) == 1:
+                return file_name
+            return get_available_name(image, file_name, taken_names)
+
+        with mock.patch.object(UploadedImage, 'get_available_name', stale_name):
+            response = self.client.post(self.url, {'images': [self.generate_image('taken.png')]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.user.uploadedimage_set.count(), 2)
+
+        with mock.patch.object(UploadedImage, 'get_available_name', lambda image, file_name, taken_names=(): file_name):
+            response = self.client.post(self.url, {'images': [self.generate_image('taken.png')]})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['rejected'], [])
+        self.assertEqual(self.user.uploadedimage_set.count(), 2)
+
+    def test_upload_unauthenticated(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post(self.url, {'images': [self.generate_image('first.png')]})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ImageDeduplicationTestCase(APITestCase):
+
+    def setUp(self):
+        tier = AccountTier.objects.create(name='test_tier_dedup', thumbnail_heights=[100])
+        self.user = get_user_model().objects.create_user(
+            username='testuser_dedup', password='testpassword', tier=tier)
+        self.other_user = get_user_model().objects.create_user(
+            username='testuser_dedup_other', password='testpassword', tier=tier)
+        self.client = APIClient()
+
+    def upload(self, user, name='dedup.png', color='blue'):
+        image = io.BytesIO()
+        Image.new('RGB', (50, 50), color=color).save(image, format='PNG')
+        image.seek(0)
+        image.name = name
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('image_upload'), {'image': image})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return UploadedImage.objects.get(user=user, name=list(response.data)[0])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_identical_uploads_share_blob(self):
+        image = self.upload(self.user)
+        other_image = self.upload(self.other_user, 'copy.png')
+        self.assertNotEqual(image.pk, other_image.pk)
+        self.assertEqual(image.image.name, other_image.image.name)
+        content_hash = image.content_hash
+        self.assertEqual(image.image.name, f'images/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.png')
+        self.assertEqual(get_thumbnail_key(image, 100, 'PNG'), get_thumbnail_key(other_image, 100, 'PNG'))
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_same_name_is_made_unique_per_user(self):
+        image = self.upload(self.user)
+        other_image = self.upload(self.user, color='green')
+        self.assertEqual(image.name, 'dedup.png')
+        self.assertNotEqual(other_image.name, image.name)
+        self.assertEqual(self.upload(self.other_user).name, 'dedup.png')
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_blob_deleted_with_last_reference(self):
+        image = self.upload(self.user, color='yellow')
+        other_image = self.upload(self.other_user, color='yellow')
+        storage = image.image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertTrue(storage.exists(other_image.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            other_image.delete()
+        self.assertFalse(storage.exists(other_image.image.name))
+
+
+class BlobReleaseRaceTestCase(TransactionTestCase):
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_release_waits_for_duplicate_upload(self):
+        tier = AccountTier.objects.create(name='test_tier_blob_race')
+        user = get_user_model().objects.create_user(username='testuser_blob_race', tier=tier)
+        other_user = get_user_model().objects.create_user(username='testuser_blob_race_other', tier=tier)
+        data = io.BytesIO()
+        Image.new('RGB', (50, 50), color=(9, 8, 7)).save(data, format='PNG')
+
+        def upload(user):
+            image = io.BytesIO(data.getvalue())
+            image.name = 'race.png'
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                response = client.post(reverse('image_upload'), {'image': image})
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            finally:
+                connection.close()
+
+        upload(user)
+        image = UploadedImage.objects.get(user=user)
+        storage = image.image.storage
+        stored = threading.Event()
+
+        def slow_store_blob(*args):
+            name = store_blob(*args)
+            # The duplicate upload found the blob stored and has not inserted its row yet.
+            stored.set()
+            time.sleep(0.3)
+            return name
+
+        with mock.patch('image_uploader.models.store_blob', slow_store_blob):
+            thread = threading.Thread(target=upload, args=[other_user])
+            thread.start()
+            self.assertTrue(stored.wait(5))
+            image.delete()
+            thread.join()
+        other_image = UploadedImage.objects.get(user=other_user)
+        self.assertEqual(other_image.image.name, image.image.name)
+        self.assertTrue(storage.exists(other_image.image.name))
+
+
+class PopulateImageMetadataMigrationTestCase(APITestCase):
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_skips_unreadable_images(self):
+        migration = importlib.import_module('image_uploader.migrations.0006_uploadedimage_metadata')
+        tier = AccountTier.objects.create(name='test_tier_migration')
+        user = get_user_model().objects.create_user(username='testuser_migration', tier=tier)
+        self.client.force_authenticate(user=user)
+        for name, size in (('bomb.png', (300, 200)), ('small.png', (30, 20))):
+            data = io.BytesIO()
+            Image.new('RGB', size, color=(5, 6, len(name))).save(data, format='PNG')
+            data.seek(0)
+            data.name = name
+            self.client.post(reverse('image_upload'), {'image': data})
+        UploadedImage.objects.filter(user=user).update(content_hash='', width=None)
+
+        # Pillow raises DecompressionBombError for images over twice MAX_IMAGE_PIXELS.
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 10_000):
+            migration.populate_image_metadata(django_apps, None)
+        self.assertEqual(UploadedImage.objects.get(user=user, name='bomb.png').content_hash, '')
+        self.assertEqual(UploadedImage.objects.get(user=user, name='small.png').width, 30)
+
+
+OBJECT_STORAGE = {
+    'IMAGE_STORAGE': 'image_uploader.storage.LocalObjectStorage',
+    'IMAGE_STORAGE_OPTIONS': {'location': TEST_DIR + '/bucket', 'base_url': 'https://bucket.example.com/'},
+}
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), **OBJECT_STORAGE)
+class ObjectStorageTestCase(APITestCase):
+
+    def setUp(self):
+        tier = AccountTier.objects.create(
+            name='test_tier_object_storage', thumbnail_heights=[100], access_to_original_image=True)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_object_storage', password='testpassword', tier=tier)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, color):
+        self.data = io.BytesIO()
+        Image.new('RGB', (200, 150), color=color).save(self.data, format='PNG')
+        self.data.seek(0)
+        self.data.name = 'object.png'
+        response = self.client.post(reverse('image_upload'), {'image': self.data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+    def test_images_served_without_local_paths(self):
+        image = self.upload((10, 20, 30))
+        storage = image.image.storage
+        self.assertIsInstance(storage, LocalObjectStorage)
+        self.assertTrue(storage.exists(image.image.name))
+        with self.assertRaises(NotImplementedError):
+            image.image.path
+        self.assertEqual(image.image_url, 'https://bucket.example.com/' + image.image.name)
+
+        response = self.client.get(reverse('get_image_by_id', args=[image.public_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.data.getvalue())
+
+        response = self.client.get(reverse('get_thumbnail_by_id', args=[image.public_id, 100]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (133, 100))
+
+    @override_settings(IMAGE_SENDFILE_BACKEND='x-accel-redirect')
+    def test_sendfile_falls_back_to_streaming(self):
+        image = self.upload((10, 20, 40))
+        response = self.client.get(reverse('get_image_by_id', args=[image.public_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(response.getvalue(), self.data.getvalue())
+
+    def test_blob_deleted_and_listed(self):
+        image = self.upload((10, 20, 50))
+        storage = image.image.storage
+        content_hash = image.content_hash
+        self.assertEqual(storage.listdir('images'), ([content_hash[:2]], []))
+        self.assertEqual(storage.listdir(f'images/{content_hash[:2]}/{content_hash[2:4]}'),
+                         ([], [f'{content_hash}.png']))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(storage.exists(image.image.name))
+
+    def tearDown(self):
+        shutil.rmtree(TEST_DIR + '/bucket', ignore_errors=True)
+
+
+class ImagePublicIdTestCase(APITestCase):
+
+    def setUp(self):
+        tier = AccountTier.objects.create(name='test_tier_public_id', thumbnail_heights=[50],
+                                          access_to_original_image=True, expiring_link_creation=True)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_public_id', password='testpassword', tier=tier)
+        self.other_user = get_user_model().objects.create_user(
+            username='testuser_public_id_other', password='testpassword', tier=tier)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def upload(self):
+        image = io.BytesIO()
+        Image.new('RGB', (100, 100), color='purple').save(image, format='PNG')
+        image.seek(0)
+        image.name = 'public.png'
+        response = self.client.post(reverse('image_upload'), {'image': image})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return UploadedImage.objects.get(user=self.user, name=list(response.data)[0]), response
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_urls_use_public_id(self):
+        image, response = self.upload()
+        urls = response.data[image.name]
+        self.assertTrue(urls['original_url'].endswith(reverse('get_image_by_id', args=[image.public_id])))
+        self.assertEqual(self.client.get(urls['original_url']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(urls['thumbnails'][0]['url']).status_code, status.HTTP_200_OK)
+        # Filename routes keep working.
+        response = self.client.get(reverse('get_image', args=[image.name]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_public_id_scoped_to_user(self):
+        image, _ = self.upload()
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(reverse('get_image_by_id', args=[image.public_id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_expiring_link_by_public_id(self):
+        image, _ = self.upload()
+        response = self.client.get(reverse('get_expiring_url_by_id', args=[image.public_id, 50, 300]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['image_url'].endswith(
+            reverse('get_thumbnail_by_id', args=[image.public_id, 50])))
+        self.client.force_authenticate(user=None)
+        response = self.client.get(response.data['expiring_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AsyncImageViewsTestCase(APITestCase):
+
+    def setUp(self):
+        tier = AccountTier.objects.create(name='test_tier_async', thumbnail_heights=[50],
+                                          access_to_original_image=True, expiring_link_creation=True)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_async', password='testpassword', tier=tier)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def upload(self, color='orange'):
+        self.data = io.BytesIO()
+        Image.new('RGB', (100, 100), color=color).save(self.data, format='PNG')
+        self.data.seek(0)
+        self.data.name = 'async.png'
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('image_upload'), {'image': self.data})
+        self.client.force_authenticate(user=None)
+        return UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_get_original(self):
+        image = self.upload()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('async_get_image_by_id', args=[image.public_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.data.getvalue())
+        self.assertEqual(response['ETag'], image.etag)
+
+        response = self.client.get(reverse('async_get_image_by_id', args=[image.public_id]),
+                                   HTTP_IF_NONE_MATCH=image.etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), ASYNC_IMAGE_BUFFER_MAX_SIZE=100)
+    def test_large_original_streamed(self):
+        image = self.upload()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('async_get_image_by_id', args=[image.public_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.getvalue(), self.data.getvalue())
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_get_thumbnail(self):
+        image = self.upload()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('async_get_thumbnail_by_id', args=[image.public_id, 50]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (50, 50))
+
+        response = self.client.get(reverse('async_get_thumbnail_by_id', args=[image.public_id, 60]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_expiring_link(self):
+        image = self.upload()
+        signature = Signer().sign_object({"image": image.id, "height": None,
+                                          "expires_at": (timezone.now() + timezone.timedelta(seconds=300)).isoformat()})
+        response = self.client.get(reverse('async_use_expiring_url'), {'signature': signature})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.data.getvalue())
+
+        response = self.client.get(reverse('async_use_expiring_url'), {'signature': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"error": "Invalid URL"})
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_url_expiring_link(self):
+        image = self.upload()
+        signature = Signer().sign_object({"url": 'http://testserver' + reverse('get_thumbnail', args=[image.name, 50]),
+                                          "expires_at": (timezone.now() + timezone.timedelta(seconds=300)).isoformat()})
+        response = self.client.get(reverse('async_use_expiring_url'), {'signature': signature})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('async_use_expiring_url'), {'signature': signature})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (50, 50))
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_only_renders_use_image_executor(self):
+        image = self.upload((200, 100, 1))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('async_get_thumbnail_by_id', args=[image.public_id, 50])
+        executor = mock.Mock(wraps=get_image_executor())
+        with mock.patch('image_uploader.async_views.get_image_executor', return_value=executor):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(executor.submit.call_count, 1)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(executor.submit.call_count, 1)
+
+    def test_not_found(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse('async_get_image_by_id', args=['missing']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), self.client.get(reverse('get_image_by_id', args=['missing'])).json())
+
+    def test_unauthenticated(self):
+        response = self.client.get(reverse('async_get_image_by_id', args=['missing']))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        response = self.client.get(reverse('async_get_image_by_id', args=['missing']))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class ImageOriginalViewTestCase(APITestCase):
 
     def setUp(self):
@@ -198,6 +699,97 @@ class ImageOriginalViewTestCase(APITestCase):
             reverse('get_image', kwargs={'path': path}))
         self.assertEqual(response_get.status_code, status.HTTP_400_BAD_REQUEST)
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_get_image_returns_stored_bytes(self):
+        self.client.force_authenticate(user=self.user_access)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+
+        response_get = self.client.get(
+            reverse('get_image', kwargs={'path': path}))
+        self.image.seek(0)
+        self.assertEqual(response_get.getvalue(), self.image.read())
+        self.assertEqual(int(response_get['Content-Length']), self.image.tell())
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), IMAGE_SENDFILE_BACKEND='x-accel-redirect')
+    def test_get_image_offloaded_to_proxy(self):
+        self.client.force_authenticate(user=self.user_access)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+
+        response_get = self.client.get(
+            reverse('get_image', kwargs={'path': path}))
+        self.assertEqual(response_get.status_code, status.HTTP_200_OK)
+        image = UploadedImage.objects.get(name=path)
+        self.assertEqual(response_get['X-Accel-Redirect'], '/protected-media/' + image.image.name)
+        self.assertEqual(response_get.content, b'')
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_get_image_conditional(self):
+        self.client.force_authenticate(user=self.user_access)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_image', kwargs={'path': path})
+
+        response_get = self.client.get(url)
+        self.assertEqual(response_get['Cache-Control'], 'private, max-age=3600')
+        self.assertEqual(response_get['Accept-Ranges'], 'bytes')
+
+        response_etag = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response_get['ETag'])
+        self.assertEqual(response_etag.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response_etag['ETag'], response_get['ETag'])
+
+        response_date = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response_get['Last-Modified'])
+        self.assertEqual(response_date.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response_changed = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response_changed.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_get_image_range(self):
+        self.client.force_authenticate(user=self.user_access)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_image', kwargs={'path': path})
+        self.image.seek(0)
+        content = self.image.read()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response.getvalue(), content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(content)}')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.getvalue(), content[-5:])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), content)
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-0')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(content)}')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=5-2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), content)
+
+    def test_range_of_empty_file(self):
+        for header in ('bytes=0-', 'bytes=-5'):
+            request = RequestFactory().get('/', HTTP_RANGE=header)
+            response = range_file_response(request, io.BytesIO(), 'image/png', '"etag"', 0)
+            self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.assertEqual(response['Content-Range'], 'bytes */0')
+
     def test_get_nonexistent_image(self):
         self.client.force_authenticate(user=self.user_access)
 
@@ -232,6 +824,73 @@ class ImageThumbnailViewTestCase(APITestCase):
         tmp_file.seek(0)
         return tmp_file
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_RENDER_CONCURRENCY=1,
+                       THUMBNAIL_RENDER_QUEUE_TIMEOUT=0, THUMBNAIL_PREGENERATE=False)
+    def test_thumbnail_render_queue_full(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        # Content not uploaded by other tests, so its thumbnail is not cached yet.
+        image = io.BytesIO()
+        Image.new('RGB', (300, 300), color=(time.time_ns() % 256, 1, 2)).save(image, format='PNG')
+        image.seek(0)
+        image.name = 'busy.png'
+        response_upload = self.client.post(reverse('image_upload'), {'image': image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_thumbnail', kwargs={'path': path, 'height': self.thumbnail_heights[1]})
+
+        with get_render_limiter().admit(0, timeout=0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '5')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_render_metrics(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = get_user_model().objects.create_user(username='testadmin', password='testpassword', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('waiting', response.data['thumbnail_render'])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_thumbnail_format_negotiation(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_thumbnail', kwargs={'path': path, 'height': self.thumbnail_heights[0]})
+
+        response_png = self.client.get(url, HTTP_ACCEPT='image/*,*/*;q=0.8')
+        self.assertEqual(response_png['Content-Type'], 'image/PNG')
+        self.assertIn('Accept', response_png['Vary'])
+
+        response_webp = self.client.get(url, HTTP_ACCEPT='image/avif,image/webp,image/*;q=0.8')
+        self.assertEqual(response_webp['Content-Type'], 'image/WEBP')
+        self.assertIn('Accept', response_webp['Vary'])
+        self.assertNotEqual(response_webp['ETag'], response_png['ETag'])
+        self.assertEqual(Image.open(io.BytesIO(response_webp.getvalue())).format, 'WEBP')
+
+        response = self.client.get(url, HTTP_ACCEPT='image/webp;q=0')
+        self.assertEqual(response['Content-Type'], 'image/PNG')
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_thumbnail_tier_quality(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_thumbnail', kwargs={'path': path, 'height': self.thumbnail_heights[1]})
+        response_default = self.client.get(url, HTTP_ACCEPT='image/webp')
+
+        self.user_thumbnails.tier.thumbnail_quality = 10
+        self.user_thumbnails.tier.save()
+        response_low = self.client.get(url, HTTP_ACCEPT='image/webp')
+        self.assertNotEqual(response_low['ETag'], response_default['ETag'])
+
     @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
     def test_valid_thumbnail_smaller(self):
         self.client.force_authenticate(user=self.user_thumbnails)
@@ -248,7 +907,7 @@ class ImageThumbnailViewTestCase(APITestCase):
 
         self.assertEqual(response['Content-Type'], 'image/PNG')
 
-        image = Image.open(io.BytesIO(response.content))
+        image = Image.open(io.BytesIO(response.getvalue()))
         self.assertEqual(image.format, 'PNG')
         self.assertEqual(image.size[0], self.thumbnail_heights[0])
         self.assertEqual(image.size[1], self.thumbnail_heights[0])
@@ -269,7 +928,7 @@ class ImageThumbnailViewTestCase(APITestCase):
 
         self.assertEqual(response['Content-Type'], 'image/PNG')
 
-        image = Image.open(io.BytesIO(response.content))
+        image = Image.open(io.BytesIO(response.getvalue()))
         self.assertEqual(image.format, 'PNG')
         self.assertEqual(image.size[0], self.thumbnail_heights[-1])
         self.assertEqual(image.size[1], self.thumbnail_heights[-1])
@@ -290,7 +949,7 @@ class ImageThumbnailViewTestCase(APITestCase):
 
         self.assertEqual(response['Content-Type'], 'image/PNG')
 
-        image = Image.open(io.BytesIO(response.content))
+        image = Image.open(io.BytesIO(response.getvalue()))
         self.assertEqual(image.format, 'PNG')
         self.assertEqual(image.size[0], self.thumbnail_heights[-2])
         self.assertEqual(image.size[1], self.thumbnail_heights[-2])
@@ -327,6 +986,626 @@ class ImageThumbnailViewTestCase(APITestCase):
         self.assertEqual(
             response.data["error"], "The requested thumbnail height is not allowed for this user's tier")
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_thumbnail_served_from_cache(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_thumbnail', kwargs={
+            'path': path, 'height': self.thumbnail_heights[0]})
+
+        first = self.client.get(url).getvalue()
+        with mock.patch('image_uploader.thumbnails.render_thumbnail') as render:
+            response = self.client.get(url)
+            render.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/PNG')
+        self.assertEqual(response.getvalue(), first)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_thumbnails_pregenerated_on_upload(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        self.assertEqual(ImageJob.objects.count(), 1)
+        call_command('process_image_jobs', once=True, workers=0, stdout=io.StringIO())
+        self.assertEqual(ImageJob.objects.count(), 0)
+
+        with mock.patch('image_uploader.thumbnails.render_thumbnail') as render:
+            for height in self.thumbnail_heights:
+                response = self.client.get(reverse('get_thumbnail', kwargs={
+                    'path': path, 'height': height}))
+                image = Image.open(io.BytesIO(response.getvalue()))
+                self.assertEqual(image.size, (height, height))
+            render.assert_not_called()
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_negotiated_formats_pregenerated_on_upload(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        image = io.BytesIO()
+        # Content not uploaded by other tests, so none of its thumbnails are cached yet.
+        Image.new('RGB', (600, 600), color=(250, 19, 19)).save(image, format='PNG')
+        image.seek(0)
+        image.name = 'negotiated.png'
+        response_upload = self.client.post(reverse('image_upload'), {'image': image})
+        path = list(response_upload.json().keys())[0]
+        call_command('process_image_jobs', once=True, workers=0, stdout=io.StringIO())
+
+        with mock.patch('image_uploader.thumbnails.render_thumbnail') as render:
+            for height in self.thumbnail_heights:
+                response = self.client.get(reverse('get_thumbnail', kwargs={
+                    'path': path, 'height': height}), HTTP_ACCEPT='image/webp')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Type'], 'image/WEBP')
+                self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (height, height))
+            render.assert_not_called()
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def test_thumbnails_not_pregenerated_when_disabled(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        self.assertEqual(response_upload.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ImageJob.objects.count(), 0)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def test_pregenerated_thumbnails_match_on_demand_renders(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        for image_format in ('PNG', 'JPEG'):
+            data = io.BytesIO()
+            fractal = Image.effect_mandelbrot((401, 300), (-2.0, -1.25, 0.75, 1.25), 32)
+            Image.merge('RGB', (fractal, fractal.rotate(180), fractal.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+                data, format=image_format)
+            data.seek(0)
+            data.name = 'detailed.' + image_format.lower()
+            response = self.client.post(reverse('image_upload'), {'image': data})
+            image = UploadedImage.objects.get(user=self.user_thumbnails, name=list(response.data)[0])
+
+            pregenerate_thumbnails(image, [200, 100, 30])
+            for height in (200, 100, 30):
+                rendered = io.BytesIO()
+                render_thumbnail(image, height, image_format, rendered)
+                with get_thumbnail_cache().open(get_thumbnail_key(image, height, image_format), image_format) as cached:
+                    self.assertEqual(cached.read(), rendered.getvalue(), f'{image_format} {height}')
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_thumbnail_not_modified(self):
+        self.client.force_authenticate(user=self.user_thumbnails)
+        response_upload = self.client.post(reverse('image_upload'),
+                                           {'image': self.image}, format='multipart')
+        path = list(response_upload.json().keys())[0]
+        url = reverse('get_thumbnail', kwargs={
+            'path': path, 'height': self.thumbnail_heights[0]})
+
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        other_height = self.client.get(reverse('get_thumbnail', kwargs={
+            'path': path, 'height': self.thumbnail_heights[1]}))
+        self.assertNotEqual(response['ETag'], other_height['ETag'])
+
+        with mock.patch('image_uploader.views.get_thumbnail') as thumbnail:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            thumbnail.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class NegotiateOutputFormatTestCase(TestCase):
+    def setUp(self):
+        self.image = UploadedImage(format='PNG')
+
+    def test_explicit_types_only(self):
+        self.assertEqual(negotiate_output_format(self.image, ''), 'PNG')
+        self.assertEqual(negotiate_output_format(self.image, '*/*'), 'PNG')
+        self.assertEqual(negotiate_output_format(self.image, 'image/webp,*/*'), 'WEBP')
+        self.assertEqual(negotiate_output_format(self.image, 'image/WebP; q=0.5'), 'WEBP')
+        self.assertEqual(negotiate_output_format(self.image, 'image/webp;q=0'), 'PNG')
+
+    @override_settings(THUMBNAIL_NEGOTIATED_FORMATS=['NOT-A-FORMAT', 'WEBP'])
+    def test_unsupported_formats_skipped(self):
+        self.assertEqual(negotiate_output_format(self.image, 'image/not-a-format,image/webp'), 'WEBP')
+
+
+ENCODING_PROFILES = {
+    'default': {
+        'JPEG': {'quality': 85, 'progressive': True},
+        'strip_exif': True,
+        'heights': {100: {'JPEG': {'quality': 60}}, 300: {'JPEG': {'quality': 75}}},
+    },
+    'compact': {
+        'PNG': {'colors': 16},
+        'strip_exif': True,
+        'strip_icc': True,
+    },
+}
+
+
+@override_settings(THUMBNAIL_ENCODING_PROFILES=ENCODING_PROFILES, THUMBNAIL_DEFAULT_ENCODING_PROFILE='default')
+class EncodingProfileTestCase(TestCase):
+    def thumbnail(self, mode='RGB'):
+        image = Image.effect_mandelbrot((120, 90), (-2.0, -1.25, 0.75, 1.25), 64).convert(mode)
+        image.info['icc_profile'] = b'not a real profile'
+        image.info['exif'] = b'Exif\x00\x00not real exif'
+        return image
+
+    def test_height_overrides(self):
+        self.assertEqual(get_encoder_options('JPEG', 50)['quality'], 60)
+        self.assertEqual(get_encoder_options('JPEG', 200)['quality'], 75)
+        self.assertEqual(get_encoder_options('JPEG', 400)['quality'], 85)
+        self.assertTrue(get_encoder_options('JPEG', 400)['progressive'])
+
+    def test_profile_and_tier_quality(self):
+        self.assertEqual(get_encoder_options('PNG', 50, {'profile': 'compact'})['colors'], 16)
+        self.assertEqual(get_encoder_options('PNG', 50, {'profile': 'unknown'})['colors'], None)
+        self.assertEqual(get_encoder_options('JPEG', 50, {'profile': '', 'quality': 30})['quality'], 30)
+        self.assertNotIn('quality', get_encoder_options('PNG', 50, {'quality': 30}))
+
+    def test_profile_changes_thumbnail_key(self):
+        image = UploadedImage(content_hash='0' * 64)
+        self.assertNotEqual(get_thumbnail_key(image, 100, 'PNG'),
+                            get_thumbnail_key(image, 100, 'PNG', {'profile': 'compact'}))
+
+    def test_metadata_stripping(self):
+        output = io.BytesIO()
+        save_thumbnail(self.thumbnail(), 'PNG', output)
+        saved = Image.open(output)
+        self.assertEqual(saved.info.get('icc_profile'), b'not a real profile')
+        self.assertNotIn('exif', saved.info)
+
+        output = io.BytesIO()
+        save_thumbnail(self.thumbnail(), 'PNG', output, {'profile': 'compact'})
+        saved = Image.open(output)
+        self.assertNotIn('icc_profile', saved.info)
+        self.assertEqual(saved.mode, 'P')
+        self.assertLessEqual(len(saved.getcolors()), 16)
+
+    def test_quantize_keeps_transparency(self):
+        output = io.BytesIO()
+        save_thumbnail(self.thumbnail('RGBA'), 'PNG', output, {'profile': 'compact'})
+        saved = Image.open(output)
+        self.assertEqual(saved.mode, 'P')
+        self.assertIn('transparency', saved.info)
+
+
+class ReadImageHeaderTestCase(TestCase):
+    def encode(self, image, image_format, **params):
+        output = io.BytesIO()
+        image.save(output, format=image_format, **params)
+        output.seek(0)
+        return output
+
+    def test_png(self):
+        for mode in ('1', 'L', 'RGB', 'RGBA', 'P', 'LA'):
+            file = self.encode(Image.new(mode, (30, 20)), 'PNG')
+            self.assertEqual(read_image_header(file), ('PNG', 30, 20, mode, 1))
+            self.assertEqual(file.tell(), 0)
+
+    def test_animated_png(self):
+        frames = [Image.new('RGB', (30, 20), color) for color in ('red', 'green', 'blue')]
+        file = self.encode(frames[0], 'PNG', save_all=True, append_images=frames[1:])
+        self.assertEqual(read_image_header(file).frames, 3)
+
+    def test_jpeg(self):
+        icc_profile = b'\0' * 70000
+        for mode in ('L', 'RGB', 'CMYK'):
+            file = self.encode(Image.new(mode, (30, 20)), 'JPEG', icc_profile=icc_profile)
+            self.assertEqual(read_image_header(file), ('JPEG', 30, 20, mode, 1))
+        file = self.encode(Image.new('RGB', (30, 20)), 'JPEG', progressive=True)
+        self.assertEqual(read_image_header(file), ('JPEG', 30, 20, 'RGB', 1))
+
+    def test_invalid(self):
+        data = self.encode(Image.new('RGB', (30, 20)), 'JPEG').getvalue()
+        self.assertIsNone(read_image_header(io.BytesIO(data[:10])))
+        self.assertIsNone(read_image_header(io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 8)))
+        self.assertIsNone(read_image_header(self.encode(Image.new('RGB', (30, 20)), 'BMP')))
+
+    def test_metadata_reuses_header(self):
+        file = self.encode(Image.new('RGB', (30, 20)), 'PNG')
+        validate_image_header(file)
+        with mock.patch('PIL.Image.open') as image_open:
+            metadata = read_image_metadata(file)
+        image_open.assert_not_called()
+        self.assertEqual((metadata['width'], metadata['height'], metadata['format']), (30, 20, 'PNG'))
+
+
+class ImageURLBuilderTestCase(TestCase):
+    def test_matches_reverse(self):
+        request = RequestFactory().get('/')
+        for image_name in ['Ab3_-x9Qz0w', 'my id', 'zdjęcie%20?#', "a;b=c&d'"]:
+            expected = {
+                'original_url': request.build_absolute_uri(reverse('get_image_by_id', args=[image_name])),
+                'thumbnails': [{'height': height, 'url': request.build_absolute_uri(reverse(
+                    'get_thumbnail_by_id', kwargs={'public_id': image_name, 'height': height}))} for height in [100, 200]],
+            }
+            self.assertEqual(ImageURLBuilder(request, True, [100, 200]).build(image_name), expected)
+
+    def test_without_original(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(create_image_url_dict(request, 'image.png'), {'thumbnails': []})
+
+
+class ResizeImageByHeightTestCase(TestCase):
+    def open_jpeg(self, size):
+        output = io.BytesIO()
+        Image.new('RGB', size, color='blue').save(output, format='JPEG')
+        output.seek(0)
+        return Image.open(output)
+
+    def test_jpeg_decoded_at_reduced_size(self):
+        image = self.open_jpeg((2400, 1600))
+        thumbnail = resize_image_by_height(image, 200)
+
+        self.assertEqual(thumbnail.size, (300, 200))
+        self.assertEqual(thumbnail.format, 'JPEG')
+        self.assertLess(image.size[1], 1600)
+        self.assertGreaterEqual(image.size[1], 200)
+
+    @override_settings(THUMBNAIL_JPEG_DRAFT=False, THUMBNAIL_REDUCING_GAP=None)
+    def test_jpeg_draft_disabled(self):
+        image = self.open_jpeg((2400, 1600))
+        thumbnail = resize_image_by_height(image, 200)
+
+        self.assertEqual(thumbnail.size, (300, 200))
+        self.assertEqual(image.size, (2400, 1600))
+
+
+class ThumbnailCacheTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_put_and_open(self):
+        cache = ThumbnailCache(self.root, max_size=1024)
+        key = cache.make_key('images/a.png', 100, 'PNG', {})
+        self.assertIsNone(cache.open(key, 'PNG'))
+
+        cache.put(key, 'PNG', lambda output: output.write(b'data')).close()
+        with cache.open(key, 'PNG') as cached:
+            self.assertEqual(cached.read(), b'data')
+        self.assertEqual(os.listdir(os.path.dirname(cache.path(key, 'PNG'))),
+                         [os.path.basename(cache.path(key, 'PNG'))])
+
+    def test_evicts_least_recently_used(self):
+        cache = ThumbnailCache(self.root, max_size=250)
+        keys = [cache.make_key(index) for index in range(3)]
+        for age, key in enumerate(keys):
+            cache.put(key, 'PNG', lambda output: output.write(b'x' * 100)).close()
+            os.utime(cache.path(key, 'PNG'), (1000 + age, 1000 + age))
+        cache.put(cache.make_key(3), 'PNG',
+                  lambda output: output.write(b'x' * 100)).close()
+
+        self.assertIsNone(cache.open(keys[0], 'PNG'))
+        self.assertIsNone(cache.open(keys[1], 'PNG'))
+        self.assertIsNotNone(cache.open(keys[2], 'PNG'))
+
+
+class RenderLimiterTestCase(TestCase):
+    def test_admits_by_count_and_pixels(self):
+        limiter = RenderLimiter(max_concurrency=2, max_pixels=100)
+        with limiter.admit(60, timeout=0):
+            with self.assertRaises(RenderQueueFull):
+                with limiter.admit(60, timeout=0):
+                    pass
+            with limiter.admit(40, timeout=0):
+                self.assertEqual(limiter.stats()['running_pixels'], 100)
+                with self.assertRaises(RenderQueueFull):
+                    with limiter.admit(0, timeout=0):
+                        pass
+        # An image larger than max_pixels still runs alone.
+        with limiter.admit(1000, timeout=0):
+            self.assertEqual(limiter.stats()['running'], 1)
+        stats = limiter.stats()
+        self.assertEqual((stats['admitted'], stats['rejected'], stats['running']), (3, 2, 0))
+
+    def test_waiting_request_admitted_on_release(self):
+        limiter = RenderLimiter(max_concurrency=1, max_pixels=100)
+        admitted = threading.Event()
+
+        def render():
+            with limiter.admit(10, timeout=5):
+                admitted.set()
+
+        with limiter.admit(10, timeout=0):
+            thread = threading.Thread(target=render)
+            thread.start()
+            time.sleep(0.05)
+            self.assertEqual(limiter.stats()['waiting'], 1)
+            self.assertFalse(admitted.is_set())
+        thread.join()
+        self.assertTrue(admitted.is_set())
+
+
+class ImagePixelLimitTestCase(APITestCase):
+
+    def setUp(self):
+        self.tier = AccountTier.objects.create(name='test_tier_pixel_limit', thumbnail_heights=[50],
+                                               max_image_pixels=100 * 100)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_pixel_limit', password='testpassword', tier=self.tier)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def upload(self, size, color):
+        data = io.BytesIO()
+        Image.new('RGB', size, color=color).save(data, format='PNG')
+        data.seek(0)
+        data.name = 'pixels.png'
+        response = self.client.post(reverse('image_upload'), {'image': data})
+        return UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_tier_limit(self):
+        image = self.upload((100, 100), (1, 2, 3))
+        response = self.client.get(reverse('get_thumbnail_by_id', args=[image.public_id, 50]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        image = self.upload((101, 100), (1, 2, 4))
+        response = self.client.get(reverse('get_thumbnail_by_id', args=[image.public_id, 50]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('too large', response.data['error'])
+
+        self.tier.max_image_pixels = None
+        self.tier.save()
+        response = self.client.get(reverse('get_thumbnail_by_id', args=[image.public_id, 50]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_limit_checked_in_image_header(self):
+        image = self.upload((120, 100), (1, 2, 5))
+        UploadedImage.objects.filter(pk=image.pk).update(width=None, height=None)
+        image.refresh_from_db()
+        with self.assertRaises(ImageTooLarge):
+            render_thumbnail(image, 50, 'PNG', io.BytesIO(), max_pixels=100 * 100)
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaises(ImageTooLarge):
+                render_thumbnail(image, 50, 'PNG', io.BytesIO())
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_pregenerate_job_skips_large_images(self):
+        image = self.upload((120, 100), (1, 2, 6))
+        pregenerate_thumbnails_job(image.id, [50], self.tier.encoding, self.tier.image_pixel_limit)
+        self.assertIsNone(get_thumbnail_cache().open(get_thumbnail_key(image, 50, 'PNG', self.tier.encoding), 'PNG'))
+
+
+class RenderLockTestCase(APITestCase):
+    def setUp(self):
+        tier = AccountTier.objects.create(name='test_tier_lock', thumbnail_heights=[40])
+        self.user = get_user_model().objects.create_user(
+            username='testuser_lock', password='testpassword', tier=tier)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def assert_single_render(self, lock_class, color):
+        image_file = io.BytesIO()
+        Image.new('RGB', (80, 80), color=color).save(image_file, format='PNG')
+        image_file.seek(0)
+        image_file.name = 'lock.png'
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('image_upload'), {'image': image_file})
+        image = UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+        renders = []
+        results = []
+
+        def slow_render(*args):
+            renders.append(args)
+            time.sleep(0.2)
+            render_thumbnail(*args)
+
+        def request_thumbnail():
+            try:
+                file, _ = get_thumbnail(image, 40)
+                with file:
+                    results.append(file.read())
+            finally:
+                connection.close()
+
+        with override_settings(THUMBNAIL_RENDER_LOCK=lock_class), \
+                mock.patch('image_uploader.thumbnails.render_thumbnail', slow_render):
+            threads = [threading.Thread(target=request_thumbnail) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(results)), 1)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def assert_waiters_rejected_together(self, lock_class, color):
+        image_file = io.BytesIO()
+        Image.new('RGB', (80, 80), color=color).save(image_file, format='PNG')
+        image_file.seek(0)
+        image_file.name = 'lock.png'
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('image_upload'), {'image': image_file})
+        image = UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+        errors = []
+
+        def request_thumbnail():
+            try:
+                get_thumbnail(image, 40)
+            except RenderQueueFull as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        timeout = 0.5
+        with override_settings(THUMBNAIL_RENDER_LOCK=lock_class, THUMBNAIL_RENDER_QUEUE_TIMEOUT=timeout,
+                               THUMBNAIL_RENDER_CONCURRENCY=1, THUMBNAIL_RENDER_MAX_PIXELS=sum(color)):
+            # The only render slot stays taken, so the request holding the render lock is rejected and the two
+            # waiting for that render have to give up by the same deadline.
+            with get_render_limiter().admit(0, timeout=0):
+                started = time.monotonic()
+                threads = [threading.Thread(target=request_thumbnail) for _ in range(3)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.monotonic() - started
+        self.assertEqual(len(errors), 3)
+        self.assertLess(elapsed, timeout * 1.8)
+
+    def test_process_lock(self):
+        self.assert_single_render('image_uploader.locks.ProcessRenderLock', (10, 3, 4))
+
+    def test_process_lock_timeout(self):
+        self.assert_waiters_rejected_together('image_uploader.locks.ProcessRenderLock', (11, 3, 4))
+
+    def test_file_lock_timeout(self):
+        self.assert_waiters_rejected_together('image_uploader.locks.FileRenderLock', (21, 3, 4))
+
+    def test_database_lock_timeout(self):
+        self.assert_waiters_rejected_together('image_uploader.locks.DatabaseRenderLock', (31, 3, 4))
+
+    def test_file_lock(self):
+        self.assert_single_render('image_uploader.locks.FileRenderLock', (20, 3, 4))
+
+    def test_database_lock(self):
+        self.assert_single_render('image_uploader.locks.DatabaseRenderLock', (30, 3, 4))
+
+
+class DatabaseJobQueueTestCase(TestCase):
+    def test_failed_job_is_retried_until_max_attempts(self):
+        queue = DatabaseJobQueue()
+        queue.enqueue('pregenerate_thumbnails', image_id=1, heights=[100])
+
+        with override_settings(IMAGE_JOB_MAX_ATTEMPTS=2):
+            for expected_status in (ImageJob.PENDING, ImageJob.FAILED):
+                job, = queue.claim(10)
+                self.assertEqual(ImageJob.objects.get().status, ImageJob.RUNNING)
+                queue.fail(job, IOError('broken image'))
+                self.assertEqual(ImageJob.objects.get().status, expected_status)
+
+        self.assertEqual(queue.claim(10), [])
+        self.assertIn('broken image', ImageJob.objects.get().error)
+
+    def test_worker_skips_deleted_images(self):
+        DatabaseJobQueue().enqueue('pregenerate_thumbnails', image_id=0, heights=[100])
+        call_command('process_image_jobs', once=True, workers=0, stdout=io.StringIO())
+        self.assertFalse(ImageJob.objects.exists())
+
+
+class BatchSignerTestCase(TestCase):
+    def test_matches_signer(self):
+        data = {"image": 1, "height": 200, "expires_at": timezone.now().isoformat()}
+        signed = BatchSigner().sign_object(data)
+        self.assertEqual(signed, Signer().sign_object(data))
+        self.assertEqual(Signer().unsign_object(signed), data)
+
+    @override_settings(SECRET_KEY='new-secret', SECRET_KEY_FALLBACKS=['old-secret'])
+    def test_fallback_keys(self):
+        signed = Signer(key='old-secret').sign_object({"image": 1})
+        self.assertEqual(BatchSigner().unsign_object(signed), {"image": 1})
+
+
+class ExpiringLinkTokenTestCase(TestCase):
+    def test_round_trip(self):
+        expires_at = int(time.time()) + 60
+        token = make_token(12345, 200, expires_at)
+        self.assertEqual(len(token), TOKEN_LENGTH)
+        self.assertEqual(read_token(token), ExpiringLink(12345, 200, expires_at))
+        self.assertEqual(read_token(make_token(7, None, expires_at)), ExpiringLink(7, None, expires_at))
+
+    def test_invalid_tokens(self):
+        token = make_token(1, 200, int(time.time()) + 60)
+        tampered = ('B' if token[5] == 'A' else 'A').join((token[:5], token[6:]))
+        for invalid in (tampered, token[:-1], token + 'A', '!' * TOKEN_LENGTH, ''):
+            with self.assertRaises(InvalidToken):
+                read_token(invalid)
+        with self.assertRaises(ExpiredToken):
+            read_token(token, now=time.time() + 61)
+        with self.assertRaises(InvalidToken):
+            make_token(1, 200, int(time.time()), key_id=2)
+
+    def test_key_rotation(self):
+        with override_settings(EXPIRING_LINK_KEYS={1: 'old-secret'}, EXPIRING_LINK_KEY_ID=1):
+            token = make_token(1, None, int(time.time()) + 60)
+        with override_settings(EXPIRING_LINK_KEYS={1: 'old-secret', 2: 'new-secret'}, EXPIRING_LINK_KEY_ID=2):
+            self.assertEqual(read_token(token).image_id, 1)
+            self.assertNotEqual(make_token(1, None, int(time.time()) + 60), token)
+        with override_settings(EXPIRING_LINK_KEYS={1: 'new-secret', 2: 'new-secret'}, EXPIRING_LINK_KEY_ID=2):
+            with self.assertRaises(InvalidToken):
+                read_token(token)
+        with override_settings(EXPIRING_LINK_KEYS={2: 'new-secret'}, EXPIRING_LINK_KEY_ID=2):
+            with self.assertRaises(InvalidToken):
+                read_token(token)
+
+
+class ImageManifestViewTestCase(APITestCase):
+    def setUp(self):
+        self.tier = AccountTier.objects.create(
+            name='test_tier_manifest', thumbnail_heights=[100, 50], access_to_original_image=True,
+            expiring_link_creation=True)
+        self.user = get_user_model().objects.create_user(
+            username='testuser_manifest', password='testpassword', tier=self.tier)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('image_manifest')
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'), THUMBNAIL_PREGENERATE=False)
+    def upload(self, name, color):
+        data = io.BytesIO()
+        Image.new('RGB', (300, 200), color=color).save(data, format='PNG')
+        data.seek(0)
+        data.name = name
+        response = self.client.post(reverse('image_upload'), {'image': data})
+        return UploadedImage.objects.get(user=self.user, name=list(response.data)[0])
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_manifest(self):
+        first, second = self.upload('first.png', (7, 8, 9)), self.upload('second.png', (7, 8, 10))
+        ids = [second.public_id, 'unknown', first.public_id]
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data['images']), [second.public_id, first.public_id])
+        self.assertEqual(response.data['missing'], ['unknown'])
+
+        entry = response.data['images'][first.public_id]
+        request = RequestFactory().get('/')
+        expected = create_image_url_dict(request, first.public_id, True, [50, 100])
+        self.assertEqual(entry['original_url'], expected['original_url'])
+        self.assertEqual(entry['thumbnails'], [
+            dict(thumbnail, width=width) for thumbnail, width in zip(expected['thumbnails'], [75, 150])])
+        self.assertEqual(entry['srcset'], f"{expected['thumbnails'][0]['url']} 75w, {expected['thumbnails'][1]['url']} 150w")
+        self.assertNotIn('expiring_thumbnails', entry)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_manifest_expiring_links(self):
+        image = self.upload('expiring.png', (7, 8, 11))
+        response = self.client.post(self.url, {'ids': [image.public_id], 'expire': 600}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = response.data['images'][image.public_id]
+        self.assertIn('expire_at', response.data)
+        self.assertTrue(entry['srcset'].startswith(entry['expiring_thumbnails'][0]['url']))
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(entry['expiring_thumbnails'][1]['url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (150, 100))
+        response = self.client.get(entry['expiring_original_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_requests(self):
+        response = self.client.post(self.url, {'ids': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'ids': [], 'expire': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(IMAGE_MANIFEST_MAX_IMAGES=1):
+            response = self.client.post(self.url, {'ids': ['a', 'b']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.tier.expiring_link_creation = False
+        self.tier.save()
+        response = self.client.post(self.url, {'ids': [], 'expire': 600}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class GetExpiringLinkViewTestCase(APITestCase):
     def setUp(self):
@@ -342,6 +1621,9 @@ class GetExpiringLinkViewTestCase(APITestCase):
         self.client = APIClient()
 
         self.image = self.generate_image()
+        self.client.force_authenticate(user=self.user_full_tier)
+        self.create_uploaded_image(self.image)
+        self.client.force_authenticate(user=None)
 
         self.url_thumbnail = reverse('get_expiring_url', args=[
             os.path.basename(self.image.name), 200, 3600])
@@ -351,6 +1633,10 @@ class GetExpiringLinkViewTestCase(APITestCase):
     def tearDown(self):
         self.image.close()
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def create_uploaded_image(self, image):
+        self.client.post(reverse('image_upload'), {'image': image})
+
     def generate_image(self, suffix='.png'):
         image = Image.new('RGB', (100, 100), color='red')
         tmp_file = tempfile.NamedTemporaryFile(suffix=suffix)
@@ -408,6 +1694,27 @@ class GetExpiringLinkViewTestCase(APITestCase):
         self.assertEqual(
             response.data["error"], 'Expiration time must be an integer between 300 and 30000')
 
+    def test_get_expiring_link_nonexistent_image(self):
+        self.client.force_authenticate(user=self.user_full_tier)
+
+        url = reverse('get_expiring_url', args=['nonexistent_image.png', 3600])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_expiring_link_not_allowed_height(self):
+        self.client.force_authenticate(user=self.user_full_tier)
+
+        url = reverse('get_expiring_url', args=[
+            os.path.basename(self.image.name), 400, 3600])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["error"], "The requested thumbnail height is not allowed for this user's tier")
+
     def test_get_expiring_link_not_allowed_tier(self):
         self.client.force_authenticate(user=self.user_empty_tier)
 
@@ -452,19 +1759,31 @@ class ExpiringLinkViewTestCase(APITestCase):
 
     @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
     def test_valid_signature(self):
-        self.skipTest(
-            "Authentication problem that happens only on testserver.")
-        # self.client.force_authenticate(user=self.user_full_tier)
-
+        self.client.post(reverse('image_upload'), {
+                         'image': self.image}, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
         response = self.client.get(
             self.url, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        response = self.client.get(response.data["expiring_url"])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], "image/PNG")
+        self.image.seek(0)
+        self.assertEqual(response.getvalue(), self.image.read())
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_valid_signature_thumbnail(self):
         self.client.post(reverse('image_upload'), {
                          'image': self.image}, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
         response = self.client.get(
-            response.data["expiring_url"], HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+            self.url_thumbnail, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        response = self.client.get(response.data["expiring_url"])
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response['Content-Type'], "images/JPEG")
+        self.assertEqual(response['Content-Type'], "image/PNG")
+        image = Image.open(io.BytesIO(response.getvalue()))
+        self.assertEqual(image.size, (200, 200))
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(3590 <= max_age <= 3600)
 
     def test_expired_signature(self):
         signer = Signer()
@@ -478,6 +1797,57 @@ class ExpiringLinkViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['error'], 'URL has expired')
 
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_compact_signature(self):
+        self.client.post(reverse('image_upload'), {
+                         'image': self.image}, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        response = self.client.get(
+            self.url_thumbnail, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        signature = response.data["expiring_url"].split('signature=')[1]
+        self.assertEqual(len(signature), TOKEN_LENGTH)
+        self.assertNotIn(':', signature)
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_legacy_signature(self):
+        self.client.post(reverse('image_upload'), {
+                         'image': self.image}, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        image = UploadedImage.objects.get(user=self.user_full_tier)
+        signature = Signer().sign_object({"image": image.id, "height": 200, "expires_at": (
+            timezone.now() + timezone.timedelta(seconds=300)).isoformat()})
+
+        response = self.client.get(reverse('use_expiring_url'), {'signature': signature})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (200, 200))
+
+    @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+    def test_url_signature(self):
+        self.client.post(reverse('image_upload'), {
+                         'image': self.image}, HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        image = UploadedImage.objects.get(user=self.user_full_tier)
+        expires_at = (timezone.now() + timezone.timedelta(seconds=300)).isoformat()
+        thumbnail_signature = Signer().sign_object({
+            "url": 'http://testserver' + reverse('get_thumbnail', args=[image.name, 200]), "expires_at": expires_at})
+        original_signature = Signer().sign_object({
+            "url": 'http://testserver' + reverse('get_image', args=[image.name]), "expires_at": expires_at})
+
+        response = self.client.get(reverse('use_expiring_url'), {'signature': thumbnail_signature})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.user_full_tier_token.key}')
+        response = self.client.get(reverse('use_expiring_url'), {'signature': thumbnail_signature})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Image.open(io.BytesIO(response.getvalue())).size, (200, 200))
+        response = self.client.get(reverse('use_expiring_url'), {'signature': original_signature})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.image.seek(0)
+        self.assertEqual(response.getvalue(), self.image.read())
+
+        signature = Signer().sign_object({"url": 'http://testserver/list_images/', "expires_at": expires_at})
+        response = self.client.get(reverse('use_expiring_url'), {'signature': signature})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Invalid URL')
+
     def test_invalid_signature(self):
         response = self.client.get(reverse('use_expiring_url'), {
                                    'signature': 'invalid_signature'})
@@ -536,12 +1906,113 @@ class UserImageListViewTestCase(APITestCase):
         self.assertEqual(response.data[os.path.basename(
             self.image1.name)]['thumbnails'][0]['height'], 200)
 
+    @override_settings(IMAGE_LIST_PAGE_SIZE=1)
+    def test_list_images_paginated(self):
+        self.client.force_authenticate(user=self.user_full_tier)
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.data), [os.path.basename(self.image1.name)])
+        next_url = response['Link'].split(';')[0].strip('<>')
+
+        response = self.client.get(next_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), [os.path.basename(self.image2.name)])
+        self.assertNotIn('rel="next"', response['Link'])
+
+    def test_list_images_page_size(self):
+        self.client.force_authenticate(user=self.user_full_tier)
+        response = self.client.get(self.url, {'page_size': 1})
+        self.assertEqual(len(response.data), 1)
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_list_images_invalid_cursor(self):
+        self.client.force_authenticate(user=self.user_full_tier)
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_list_images_unauthenticated(self):
         self.client.force_authenticate(user=None)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class CachedTokenAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        self.tier = AccountTier.objects.create(name='test_tier_auth', thumbnail_heights=[200])
+        self.user = get_user_model().objects.create_user(
+            username='testuser_auth', password='testpassword', tier=self.tier)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = reverse('user_image_list')
+
+    def test_token_user_and_tier_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_tier_change_invalidates_cache(self):
+        self.client.get(self.url)
+        self.tier.access_to_original_image = True
+        self.tier.save()
+        response = self.client.get(reverse('get_image', kwargs={'path': 'missing.png'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_token_rejected(self):
+        self.client.get(self.url)
+        self.token.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_user_rejected(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def test_views_benchmark_outputs_json(self):
+        output = io.StringIO()
+        call_command('benchmark', 'views', iterations=1, sizes=[64], formats=['png'],
+                     stdout=output, stderr=io.StringIO())
+        report = json.loads(output.getvalue())
+
+        self.assertIn('commit', report['environment'])
+        views = report['results']['views']
+        for name in ('upload/png-64', 'thumbnail_cold/png-64', 'thumbnail/png-64',
+                     'original/png-64', 'expiring_link/png-64', 'list'):
+            self.assertEqual(views[name]['iterations'], 1)
+            self.assertIn('p99_ms', views[name])
+        self.assertFalse(AccountTier.objects.filter(name__startswith='benchmark-').exists())
+
+    def test_encoders_benchmark_reports_sizes(self):
+        output = io.StringIO()
+        call_command('benchmark', 'encoders', iterations=1, sizes=[320], formats=['png'],
+                     stdout=output, stderr=io.StringIO())
+        encoders = json.loads(output.getvalue())['results']['encoders']
+
+        for profile in settings.THUMBNAIL_ENCODING_PROFILES:
+            self.assertGreater(encoders[f'{profile}/jpeg/png-320/200']['size_bytes'], 0)
+            self.assertIn('p50_ms', encoders[f'{profile}/png/png-320/200'])
+
+    def test_tokens_benchmark(self):
+        output = io.StringIO()
+        call_command('benchmark', 'tokens', iterations=1, stdout=output, stderr=io.StringIO())
+        tokens = json.loads(output.getvalue())['results']['tokens']
+
+        self.assertEqual(tokens['token_length'], TOKEN_LENGTH)
+        self.assertLess(tokens['token_length'], tokens['signer_length'])
+        for name in ('signer_sign', 'signer_verify', 'token_sign', 'token_verify'):
+            self.assertIn('throughput_per_s', tokens[f'{name}/1000'])
+
+    def test_compare_reports_regressions(self):
+        baseline = {'results': {'views': {'list': {'p50_ms': 10.0}}}}
+        self.assertEqual(compare({'views': {'list': {'p50_ms': 10.5}}}, baseline, 0.1), [])
+        self.assertEqual(len(compare({'views': {'list': {'p50_ms': 12.0}}}, baseline, 0.1)), 1)
+
+
 def tearDownModule():
     print("\nDeleting temporary test files...\n")
     try:
@@ -0,0 +1,373 @@
+from concurrent.futures import Executor
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+import PIL.Image
+
+try:
+    import pillow_avif  # noqa: F401  Registers the AVIF plugin when installed.
+except ImportError:
+    pass
+
+from .executors import get_render_limiter
+from .locks import get_render_lock
+from .models import UploadedImage
+from .utils import resize_image_by_height, get_resize_options
+
+
+class ImageTooLarge(Exception):
+    '''
+    Raised instead of decoding an original with more pixels than allowed.
+    '''
+
+
+# Hits refresh the mtime used for LRU ordering at most this often, so a hot
+# thumbnail does not cost a metadata write on every request.
+TOUCH_INTERVAL = 60
+
+
+class ThumbnailCache:
+    '''
+    Content-addressed on-disk cache of encoded thumbnails.
+
+    Entries are stored as <root>/<key[:2]>/<key>.<format> and evicted in least recently used order
+    once the total size exceeds max_size. Writes go to a temporary file that is atomically renamed
+    into place, so readers never see a partially written thumbnail.
+    '''
+
+    def __init__(self, root: str, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        data = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key: str, image_format: str) -> str:
+        return os.path.join(self.root, key[:2], f'{key}.{image_format.lower()}')
+
+    def open(self, key: str, image_format: str) -> Optional[BinaryIO]:
+        '''
+        This function returns the cached thumbnail opened for reading, or None on a cache miss.
+        '''
+        path = self.path(key, image_format)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        mtime = os.fstat(file.fileno()).st_mtime
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return file
+
+    def put(self, key: str, image_format: str, write: Callable[[BinaryIO], None]) -> BinaryIO:
+        '''
+        This function stores the output of write(file) under key and returns the stored thumbnail opened for reading.
+        '''
+        path = self.path(key, image_format)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                write(tmp_file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        file = open(path, 'rb')
+        self._add_size(os.fstat(file.fileno()).st_size)
+        return file
+
+    def _add_size(self, size: int) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry_size for _, _, entry_size in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith(('.tmp', '.lock')):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def _evict(self) -> None:
+        '''
+        Removes least recently used entries until the cache shrinks to 90% of max_size. Open file
+        handles stay readable after removal, so concurrent responses are not interrupted.
+        '''
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_size * 0.9
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    root = os.path.join(settings.MEDIA_ROOT, settings.THUMBNAIL_CACHE_DIR)
+    max_size = settings.THUMBNAIL_CACHE_MAX_SIZE
+    with _caches_lock:
+        cache = _caches.get((root, max_size))
+        if cache is None:
+            cache = _caches[(root, max_size)] = ThumbnailCache(root, max_size)
+    return cache
+
+
+def get_thumbnail(image: UploadedImage, height: int, image_format: Optional[str] = None,
+                  key: Optional[str] = None, encoding: Optional[dict] = None,
+                  max_pixels: Optional[int] = None, render_executor: Optional[Executor] = None) -> Tuple[BinaryIO, str]:
+    '''
+    This function returns the thumbnail of the image with the given height, opened for reading, and its PIL format.
+    The thumbnail is rendered only when it is not in the cache yet, by a single request at a time (see
+    THUMBNAIL_RENDER_LOCK) and once the render limiter admits it; raises RenderQueueFull when the render lock
+    and a render slot are not both acquired within THUMBNAIL_RENDER_QUEUE_TIMEOUT seconds. Raises ImageTooLarge
+    instead of rendering from an original with more than max_pixels pixels. With render_executor, only the render
+    itself runs there; the cache lookup and the waits stay on the calling thread.
+    '''
+    cache = get_thumbnail_cache()
+    image_format = image_format or get_output_format(image)
+    key = key or get_thumbnail_key(image, height, image_format, encoding)
+
+    file = cache.open(key, image_format)
+    if file is None:
+        timeout = settings.THUMBNAIL_RENDER_QUEUE_TIMEOUT
+        deadline = time.monotonic() + timeout
+        # Concurrent requests for the same thumbnail wait here for one render and then find it in the cache. The
+        # wait for the lock and for a render slot share the queue timeout, so when the render is not admitted the
+        # requests waiting for it give up by the same deadline instead of queueing for a slot one after another.
+        with get_render_lock().lock(key, timeout):
+            file = cache.open(key, image_format)
+            if file is None:
+                pixels = (image.width or 0) * (image.height or 0)
+                check_pixels(pixels, max_pixels)
+                with get_render_limiter().admit(pixels, max(deadline - time.monotonic(), 0)):
+                    render = lambda output: render_thumbnail(  # noqa: E731
+                        image, height, image_format, output, encoding, max_pixels)
+                    if render_executor is None:
+                        file = cache.put(key, image_format, render)
+                    else:
+                        file = render_executor.submit(cache.put, key, image_format, render).result()
+    return file, image_format
+
+
+def get_output_format(image: UploadedImage) -> str:
+    return image.image_format
+
+
+def supported_output_formats() -> List[str]:
+    '''
+    This function returns the THUMBNAIL_NEGOTIATED_FORMATS the installed Pillow can encode, in order of preference.
+    '''
+    PIL.Image.init()
+    return [image_format for image_format in settings.THUMBNAIL_NEGOTIATED_FORMATS if image_format in PIL.Image.SAVE]
+
+
+def parse_accept(accept: str) -> Dict[str, float]:
+    '''
+    This function returns the media types of an Accept header mapped to their quality values.
+    '''
+    media_types = {}
+    for item in accept.split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if media_type:
+            media_types[media_type.lower()] = weight
+    return media_types
+
+
+def negotiate_output_format(image: UploadedImage, accept: str) -> str:
+    '''
+    This function returns the most preferred supported thumbnail format the client explicitly accepts (e.g.
+    "image/webp"), or the format of the original. Wildcards do not count, since clients send "image/*" or
+    "*/*" without being able to decode every format.
+    '''
+    accepted = parse_accept(accept)
+    for image_format in supported_output_formats():
+        if accepted.get('image/' + image_format.lower(), 0) > 0:
+            return image_format
+    return get_output_format(image)
+
+
+def get_encoding_profile(name: Optional[str] = None) -> dict:
+    '''
+    This function returns the THUMBNAIL_ENCODING_PROFILES entry with the given name, or the default profile when
+    the name is empty or unknown.
+    '''
+    profiles = settings.THUMBNAIL_ENCODING_PROFILES
+    default = settings.THUMBNAIL_DEFAULT_ENCODING_PROFILE
+    return profiles.get(name or default) or profiles.get(default, {})
+
+
+def get_encoder_options(image_format: str, height: Optional[int] = None, encoding: Optional[dict] = None) -> dict:
+    '''
+    This function returns the encoder settings of a thumbnail with the given format and height. encoding holds the
+    tier's "profile" name and "quality" (see AccountTier.encoding); the options of the format in the profile are
+    updated with those of the smallest "heights" entry covering the height, and the quality of lossy formats with
+    the tier's. Besides the keyword arguments of PIL.Image.save, the result holds the ENCODING_FLAGS.
+    '''
+    encoding = encoding or {}
+    profile = get_encoding_profile(encoding.get('profile'))
+    encoder_options = {
+        'strip_exif': profile.get('strip_exif', False),
+        'strip_icc': profile.get('strip_icc', False),
+        'colors': None,
+    }
+    encoder_options.update(profile.get(image_format, {}))
+    if height is not None:
+        for max_height, overrides in sorted(profile.get('heights', {}).items()):
+            if height <= max_height:
+                encoder_options.update(overrides.get(image_format, {}))
+                break
+    quality = encoding.get('quality')
+    if quality and image_format in LOSSY_FORMATS:
+        encoder_options['quality'] = quality
+    return encoder_options
+
+
+LOSSY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+# Options of an encoding profile applied by save_thumbnail rather than passed to PIL.Image.save
+ENCODING_FLAGS = ('strip_exif', 'strip_icc', 'colors')
+
+
+def get_thumbnail_key(image: UploadedImage, height: int, image_format: str, encoding: Optional[dict] = None) -> str:
+    encoder_options = get_encoder_options(image_format, height, encoding)
+    return ThumbnailCache.make_key(image.etag, height, image_format, encoder_options, get_resize_options())
+
+
+def check_pixels(pixels: int, max_pixels: Optional[int]) -> None:
+    if max_pixels and pixels > max_pixels:
+        raise ImageTooLarge(f'The image has {pixels} pixels, more than the limit of {max_pixels}')
+
+
+@contextmanager
+def open_original(image: UploadedImage, max_pixels: Optional[int] = None) -> Iterator[PIL.Image.Image]:
+    '''
+    This function opens the original of the image for decoding. Only the header is read before the pixel count
+    is checked against max_pixels and Pillow's decompression bomb limit (PIL.Image.MAX_IMAGE_PIXELS), so
+    oversized images are refused before any memory is spent on their pixels.
+    '''
+    try:
+        image_pil = image.get_image_file()
+    except PIL.Image.DecompressionBombError as error:
+        raise ImageTooLarge(str(error)) from error
+    with image_pil:
+        check_pixels(image_pil.width * image_pil.height, max_pixels)
+        yield image_pil
+
+
+def render_thumbnail(image: UploadedImage, height: int, image_format: str, output: BinaryIO,
+                     encoding: Optional[dict] = None, max_pixels: Optional[int] = None) -> None:
+    '''
+    This function resizes the image to the given height and encodes it into output.
+    '''
+    with open_original(image, max_pixels) as image_pil:
+        thumbnail = resize_image_by_height(image_pil, height)
+        save_thumbnail(thumbnail, image_format, output, encoding)
+
+
+def save_thumbnail(thumbnail: PIL.Image.Image, image_format: str, output: BinaryIO,
+                   encoding: Optional[dict] = None) -> None:
+    '''
+    This function encodes the thumbnail into output with the encoder settings of its format and height. The EXIF
+    data and ICC profile of the original are kept unless the profile strips them, and "colors" quantizes RGB(A)
+    thumbnails to a palette of that size.
+    '''
+    encoder_options = get_encoder_options(image_format, thumbnail.height, encoding)
+    strip_exif, strip_icc, colors = (encoder_options.pop(flag) for flag in ENCODING_FLAGS)
+    if not strip_exif and thumbnail.info.get('exif'):
+        encoder_options['exif'] = thumbnail.info['exif']
+    encoder_options['icc_profile'] = None if strip_icc else thumbnail.info.get('icc_profile')
+    if colors and thumbnail.mode in ('RGB', 'RGBA'):
+        method = PIL.Image.Quantize.FASTOCTREE if thumbnail.mode == 'RGBA' else PIL.Image.Quantize.MEDIANCUT
+        thumbnail = thumbnail.quantize(colors, method)
+    thumbnail.save(output, format=image_format, **encoder_options)
+
+
+def pregenerate_thumbnails(image: UploadedImage, heights: List[int], encoding: Optional[dict] = None,
+                           max_pixels: Optional[int] = None) -> None:
+    '''
+    This function renders every missing thumbnail of the image into the cache, in the format of the original and
+    in each format negotiate_output_format may serve instead. The thumbnails are stored under the keys (and served
+    with the ETags) of on-demand renders, so they have to be the same bytes render_thumbnail produces: each one is
+    resized from the full-size original, never from a larger thumbnail.
+    '''
+    cache = get_thumbnail_cache()
+    image_formats = [get_output_format(image)]
+    image_formats += [image_format for image_format in supported_output_formats() if image_format not in image_formats]
+    missing = {}
+    for height in sorted(set(heights), reverse=True):
+        for image_format in image_formats:
+            key = get_thumbnail_key(image, height, image_format, encoding)
+            cached = cache.open(key, image_format)
+            if cached is None:
+                missing.setdefault(height, []).append((image_format, key))
+            else:
+                cached.close()
+    if not missing:
+        return
+
+    for thumbnail, outputs in zip(iter_thumbnails(image, list(missing), max_pixels), missing.values()):
+        for image_format, key in outputs:
+            cache.put(key, image_format, lambda output: save_thumbnail(
+                thumbnail, image_format, output, encoding)).close()
+
+
+def iter_thumbnails(image: UploadedImage, heights: List[int], max_pixels: Optional[int] = None
+                    ) -> Iterator[PIL.Image.Image]:
+    '''
+    This function yields the image resized to each of the heights exactly as render_thumbnail resizes it. The
+    original is decoded once, except for JPEG originals with THUMBNAIL_JPEG_DRAFT: the draft scale depends on the
+    height and applies only before decoding, so those are decoded once per height.
+    '''
+    with open_original(image, max_pixels) as original:
+        if not (settings.THUMBNAIL_JPEG_DRAFT and original.format == 'JPEG'):
+            for height in heights:
+                yield resize_image_by_height(original, height)
+            return
+    for height in heights:
+        with open_original(image, max_pixels) as original:
+            yield resize_image_by_height(original, height)
\ No newline at end of file
@@ -0,0 +1,86 @@
+from collections import namedtuple
+import base64
+import binascii
+from functools import lru_cache
+import hashlib
+import hmac
+import struct
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.utils.encoding import force_bytes
+
+# Key id, image id, thumbnail height (0 for the original) and expiry as a Unix timestamp.
+PAYLOAD_FORMAT = struct.Struct('>BQHI')
+# HMAC-SHA256 truncated to 128 bits.
+MAC_SIZE = 16
+TOKEN_SIZE = PAYLOAD_FORMAT.size + MAC_SIZE
+# Base64url without padding.
+TOKEN_LENGTH = (TOKEN_SIZE * 4 + 2) // 3
+
+# path is only set for links signed before images had ids, which name the image by its file name instead.
+ExpiringLink = namedtuple('ExpiringLink', ['image_id', 'height', 'expires_at', 'path'], defaults=[None])
+
+
+class InvalidToken(Exception):
+    '''
+    Raised for expiring link tokens that are malformed, signed with an unknown key or tampered with.
+    '''
+
+
+class ExpiredToken(InvalidToken):
+    '''
+    Raised for expiring link tokens past their expiry.
+    '''
+
+
+@lru_cache(maxsize=None)
+def _keyed_hmac(secret: str) -> hmac.HMAC:
+    # The HMAC key is derived from the secret once; tokens continue from copies of the keyed state.
+    derived_key = hashlib.sha256(b'image_uploader.tokens' + force_bytes(secret)).digest()
+    return hmac.new(derived_key, digestmod=hashlib.sha256)
+
+
+def _mac(key_id: int, payload: bytes) -> bytes:
+    secret = settings.EXPIRING_LINK_KEYS.get(key_id)
+    if secret is None:
+        raise InvalidToken(f'Unknown key id {key_id}')
+    mac = _keyed_hmac(secret).copy()
+    mac.update(payload)
+    return mac.digest()[:MAC_SIZE]
+
+
+def make_token(image_id: int, height: Optional[int], expires_at: int, key_id: Optional[int] = None) -> str:
+    '''
+    This function returns a compact URL-safe token granting access to the image (or its thumbnail with the given
+    height) until the expires_at Unix timestamp, signed with the key EXPIRING_LINK_KEY_ID of EXPIRING_LINK_KEYS.
+    '''
+    key_id = settings.EXPIRING_LINK_KEY_ID if key_id is None else key_id
+    payload = PAYLOAD_FORMAT.pack(key_id, image_id, height or 0, expires_at)
+    return base64.urlsafe_b64encode(payload + _mac(key_id, payload)).rstrip(b'=').decode()
+
+
+def read_token(token: str, now: Optional[float] = None) -> ExpiringLink:
+    '''
+    This function returns the link granted by a token made by make_token. Raises InvalidToken unless the token
+    is signed with one of EXPIRING_LINK_KEYS (so keys can be rotated by adding a new key id, switching
+    EXPIRING_LINK_KEY_ID to it and removing the old one once its links have expired), and ExpiredToken
+    once it has expired.
+    '''
+    if len(token) != TOKEN_LENGTH:
+        raise InvalidToken('Invalid token length')
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidToken('Invalid token encoding')
+    # The decoder skips characters outside the alphabet.
+    if len(data) != TOKEN_SIZE:
+        raise InvalidToken('Invalid token encoding')
+    payload, mac = data[:PAYLOAD_FORMAT.size], data[PAYLOAD_FORMAT.size:]
+    key_id, image_id, height, expires_at = PAYLOAD_FORMAT.unpack(payload)
+    if not hmac.compare_digest(mac, _mac(key_id, payload)):
+        raise InvalidToken('Signature does not match')
+    if expires_at < (time.time() if now is None else now):
+        raise ExpiredToken('Token has expired')
+    return ExpiringLink(image_id, height or None, expires_at)
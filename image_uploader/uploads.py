@@ -0,0 +1,176 @@
+import hashlib
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+import PIL.Image
+
+from .blobs import release_blob
+from .models import UploadedImage
+from .validators import sniff_image_type, validate_image_header
+
+IMAGES_FIELD = 'images'
+ARCHIVE_FIELD = 'archive'
+SNIFF_SIZE = 16
+# Times the names of a batch are picked when concurrent uploads keep taking them before the insert.
+NAME_ATTEMPTS = 3
+
+
+def is_archive(header: bytes) -> bool:
+    return (header.startswith(b'PK\x03\x04')
+            or header.startswith(b'\x1f\x8b')
+            or header[257:262] == b'ustar')
+
+
+class ValidatingUploadHandler(TemporaryFileUploadHandler):
+    '''
+    Streams uploaded files to temporary files on disk while hashing them, rejecting each one as soon as its
+    content type, first bytes or size show it is not acceptable. Rejected files are skipped without being stored and
+    listed in rejected as {"file": ..., "error": ...} dicts.
+    '''
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.rejected = []
+        self.accepted = 0
+
+    def reject(self, error: str) -> None:
+        self.rejected.append({'file': self.file_name, 'error': error})
+        raise SkipFile()
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+        self.digest = hashlib.sha256()
+        if field_name == IMAGES_FIELD:
+            if self.accepted >= settings.BATCH_UPLOAD_MAX_FILES:
+                self.reject(f"Maximum number of files is {settings.BATCH_UPLOAD_MAX_FILES}")
+            if content_type.lower() not in settings.WHITELISTED_IMAGE_TYPES.values():
+                self.reject("Only JPEG and PNG images are supported")
+        elif field_name != ARCHIVE_FIELD:
+            self.reject(f"Unexpected file field {field_name}")
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            if self.field_name == IMAGES_FIELD and sniff_image_type(raw_data[:SNIFF_SIZE]) is None:
+                self.reject("Only JPEG and PNG images are supported")
+            if self.field_name == ARCHIVE_FIELD and not is_archive(raw_data):
+                self.reject("Only zip and tar archives are supported")
+        if start + len(raw_data) > self.max_size():
+            self.reject(f"Maximum file size is {self.max_size() / 1024 / 1024} MB")
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if self.field_name == IMAGES_FIELD:
+            self.accepted += 1
+            # Used as the blob key, so the file does not have to be read again to hash it.
+            file.content_hash = self.digest.hexdigest()
+        return file
+
+    def max_size(self) -> int:
+        if self.field_name == ARCHIVE_FIELD:
+            return settings.BATCH_UPLOAD_MAX_ARCHIVE_SIZE
+        return settings.IMAGE_MAX_UPLOAD_SIZE
+
+
+def iter_archive_images(archive: BinaryIO, rejected: List[dict], limit: int) -> Iterator[Tuple[str, BinaryIO]]:
+    '''
+    This function yields (file name, readable stream) for up to limit acceptable images in a zip or tar archive.
+    Members are checked using their header size and first bytes before being read; rejected members are appended to rejected.
+    '''
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zip_file:
+            members = [(info.filename, info.file_size, lambda info=info: zip_file.open(info))
+                       for info in zip_file.infolist() if not info.is_dir()]
+            yield from _iter_members(members, rejected, limit)
+        return
+
+    archive.seek(0)
+    try:
+        with tarfile.open(fileobj=archive) as tar_file:
+            members = [(info.name, info.size, lambda info=info: tar_file.extractfile(info))
+                       for info in tar_file.getmembers() if info.isfile()]
+            yield from _iter_members(members, rejected, limit)
+    except tarfile.TarError:
+        rejected.append({'file': archive.name, 'error': "Only zip and tar archives are supported"})
+
+
+def _iter_members(members, rejected: List[dict], limit: int) -> Iterator[Tuple[str, BinaryIO]]:
+    for member_name, size, open_member in members:
+        file_name = os.path.basename(member_name)
+        if not file_name or file_name.startswith('.') or '__MACOSX' in member_name:
+            continue
+        if limit <= 0:
+            rejected.append({'file': member_name, 'error': f"Maximum number of files is {settings.BATCH_UPLOAD_MAX_FILES}"})
+            continue
+        if size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            rejected.append({'file': member_name,
+                             'error': f"Maximum file size is {settings.IMAGE_MAX_UPLOAD_SIZE / 1024 / 1024} MB"})
+            continue
+        with open_member() as stream:
+            if sniff_image_type(stream.read(SNIFF_SIZE)) is None:
+                rejected.append({'file': member_name, 'error': "Only JPEG and PNG images are supported"})
+                continue
+            stream.seek(0)
+            limit -= 1
+            yield file_name, stream
+
+
+def save_uploaded_images(user, files: Iterator[Tuple[str, BinaryIO]], rejected: List[dict]) -> List[UploadedImage]:
+    '''
+    This function stores every (file name, file) pair in the blob store and creates all UploadedImage rows in a single
+    bulk insert. Files with invalid headers or that Pillow cannot read are appended to rejected. Blobs stored for this batch are released again
+    if the insert fails; raises IntegrityError when concurrent uploads took the names of the batch NAME_ATTEMPTS times.
+    '''
+    storage = UploadedImage._meta.get_field('image').storage
+    images = []
+    file_names = []
+    names = set()
+    try:
+        # Blobs stay locked until the rows referencing them are committed (see lock_blob).
+        with transaction.atomic():
+            for file_name, file in files:
+                image = UploadedImage(user=user)
+                try:
+                    validate_image_header(file)
+                except ValidationError as error:
+                    rejected.append({'file': file_name, 'error': error.messages[0]})
+                    continue
+                try:
+                    image.store_file(file, file_name, names)
+                except (PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError, SyntaxError):
+                    rejected.append({'file': file_name, 'error': "Unable to read image file"})
+                    continue
+                names.add(image.name)
+                images.append(image)
+                file_names.append(file_name)
+            return insert_images(images, file_names)
+    except BaseException:
+        for image in images:
+            release_blob(storage, image.image.name, image.content_hash)
+        raise
+
+
+def insert_images(images: List[UploadedImage], file_names: Sequence[str]) -> List[UploadedImage]:
+    '''
+    This function inserts the images in one bulk insert. Their names are picked before the insert, so a concurrent
+    upload may have taken one of them in the meantime; the names are then picked again from the file names.
+    '''
+    for attempt in range(NAME_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return UploadedImage.objects.bulk_create(images)
+        except IntegrityError:
+            if attempt == NAME_ATTEMPTS - 1:
+                raise
+        names = set()
+        for image, file_name in zip(images, file_names):
+            image.name = image.get_available_name(file_name, names)
+            names.add(image.name)
@@ -1,22 +1,42 @@
 from django.urls import path
-from .views import ImageUploadView
+from .views import ImageUploadView, BatchImageUploadView
 from django.conf import settings
 from django.conf.urls.static import static
-from .views import ObtainAuthTokenView, UserImageListView, ImageOriginalView, ImageThumbnailView, GetExpiringLinkView, ExpiringLinkView
+from .views import ObtainAuthTokenView, RenderMetricsView, UserImageListView, ImageManifestView, ImageOriginalView, ImageThumbnailView, GetExpiringLinkView, ExpiringLinkView
+from .async_views import AsyncImageOriginalView, AsyncImageThumbnailView, AsyncExpiringLinkView
 
 urlpatterns = [
     path('api/token/', ObtainAuthTokenView.as_view(), name='token_obtain_pair'),
     path('upload/', ImageUploadView.as_view(), name='image_upload'),
+    path('upload/batch/', BatchImageUploadView.as_view(), name='image_batch_upload'),
+    path('i/<str:public_id>/thumbnails/<int:height>',
+         ImageThumbnailView.as_view(), name='get_thumbnail_by_id'),
+    path('i/<str:public_id>',
+         ImageOriginalView.as_view(), name='get_image_by_id'),
     path('images/thumbnails/<path:path>/<int:height>',
          ImageThumbnailView.as_view(), name='get_thumbnail'),
     path('images/<path:path>',
          ImageOriginalView.as_view(), name='get_image'),
+    path('expiring-link/i/<str:public_id>/<int:height>/<int:expire>',
+         GetExpiringLinkView.as_view(), name='get_expiring_url_by_id'),
+    path('expiring-link/i/<str:public_id>/<int:expire>',
+         GetExpiringLinkView.as_view(), name='get_expiring_url_by_id'),
     path('expiring-link/<path:path>/<int:height>/<int:expire>',
          GetExpiringLinkView.as_view(), name='get_expiring_url'),
     path('expiring-link/<path:path>/<int:expire>',
          GetExpiringLinkView.as_view(), name='get_expiring_url'),
     path('expiring-data/images/',
          ExpiringLinkView.as_view(), name='use_expiring_url'),
+    path('images-manifest/',
+         ImageManifestView.as_view(), name='image_manifest'),
     path('list_images/',
          UserImageListView.as_view(), name='user_image_list'),
+    path('metrics/',
+         RenderMetricsView.as_view(), name='metrics'),
+    path('async/i/<str:public_id>/thumbnails/<int:height>',
+         AsyncImageThumbnailView.as_view(), name='async_get_thumbnail_by_id'),
+    path('async/i/<str:public_id>',
+         AsyncImageOriginalView.as_view(), name='async_get_image_by_id'),
+    path('async/expiring-data/images/',
+         AsyncExpiringLinkView.as_view(), name='async_use_expiring_url'),
 ]
@@ -1,35 +1,150 @@
 from urllib.request import Request
 from PIL import Image
-from django.urls import reverse
+from django.urls import reverse, get_script_prefix, get_urlconf
+from django.conf import settings
+from django.utils.http import RFC3986_SUBDELIMS
+from functools import lru_cache
+from typing import BinaryIO, List, Optional, Tuple
+from urllib.parse import quote
+import hashlib
+import os
 
 
 def resize_image_by_height(image: Image, new_height: int) -> Image:
     '''
     This function returns a resized image object with the specified height, keeping the aspect ratio of the original image.
+
+    When shrinking a JPEG that is not loaded yet, the decoder is asked to scale it down in the DCT domain first
+    (THUMBNAIL_JPEG_DRAFT), and the remaining reduction is done in stages according to THUMBNAIL_REDUCING_GAP.
     '''
     file_ext = image.format
     width, height = image.size
-    new_width = int(width * new_height / height)
+    new_width = thumbnail_width(width, height, new_height)
+    if settings.THUMBNAIL_JPEG_DRAFT and file_ext == 'JPEG' and new_height < image.height:
+        image.draft(image.mode, (new_width, new_height))
     img = image.resize((new_width, new_height),
-                       Image.ANTIALIAS)
+                       Image.Resampling[settings.THUMBNAIL_RESAMPLE],
+                       reducing_gap=settings.THUMBNAIL_REDUCING_GAP)
     img.format = file_ext
     return img
 
 
-def create_image_url_dict(request: Request, image_name: str, original_link_access: bool = False, thumbnail_heights: int = []) -> dict:
+def get_resize_options() -> tuple:
+    '''
+    This function returns the settings affecting the pixels produced by resize_image_by_height.
+    '''
+    return (settings.THUMBNAIL_RESAMPLE, settings.THUMBNAIL_REDUCING_GAP, settings.THUMBNAIL_JPEG_DRAFT)
+
+
+def thumbnail_width(width: int, height: int, new_height: int) -> int:
+    '''
+    This function returns the width of a thumbnail with the given height, keeping the aspect ratio of a width x height image.
+    '''
+    return int(width * new_height / height)
+
+
+def read_image_metadata(file: BinaryIO) -> dict:
+    '''
+    This function returns the width, height, PIL format, size in bytes and SHA-256 hex digest of an image file.
+    Only the image header is decoded. The file is left open and rewound.
+
+    Files carrying a content_hash attribute (hashed while they were being received) are not read again, and an
+    image_header attribute (see validators.validate_image_header) saves opening the file with Pillow.
+    '''
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash is None:
+        digest = hashlib.sha256()
+        file_size = 0
+        file.seek(0)
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            file_size += len(chunk)
+        content_hash = digest.hexdigest()
+    else:
+        file_size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    header = getattr(file, 'image_header', None)
+    if header is not None:
+        width, height, image_format = header.width, header.height, header.format
+    else:
+        with Image.open(file) as image:
+            width, height = image.size
+            image_format = image.format
+        file.seek(0)
+    return {
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'file_size': file_size,
+        'content_hash': content_hash,
+    }
+
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def image_format_from_name(name: str) -> Optional[str]:
+    '''
+    This function returns the PIL format name (e.g. "PNG") matching the extension of a stored image, or None if the extension is not whitelisted.
+    '''
+    extension = os.path.splitext(name)[1][1:].lower()
+    content_type = settings.WHITELISTED_IMAGE_TYPES.get(extension)
+    if content_type is None:
+        return None
+    return content_type.split('/')[1].upper()
+
+
+class ImageURLBuilder:
+    '''
+    Builds the URL dictionaries returned by create_image_url_dict for many images of one request.
+
+    Routes are reversed once with a placeholder id and made absolute once per request; each public image
+    id is then quoted the same way reverse() would quote it and substituted into those templates.
+    '''
+
+    def __init__(self, request: Request, original_link_access: bool = False, thumbnail_heights: List[int] = []):
+        self.original_template = None
+        if original_link_access:
+            self.original_template = absolute_url_template(
+                request, 'get_image_by_id', {'public_id': URL_ID_PLACEHOLDER})
+        self.thumbnail_templates = [
+            (height, absolute_url_template(
+                request, 'get_thumbnail_by_id', {'public_id': URL_ID_PLACEHOLDER, 'height': height}))
+            for height in thumbnail_heights]
+
+    def build(self, public_id: str) -> dict:
+        quoted_id = quote(public_id, safe=URL_SAFE_CHARACTERS)
+        url_dict = {}
+        if self.original_template is not None:
+            url_dict["original_url"] = quoted_id.join(self.original_template)
+        url_dict["thumbnails"] = [{"height": height, "url": quoted_id.join(template)}
+                                  for height, template in self.thumbnail_templates]
+        return url_dict
+
+
+# Characters reverse() leaves unquoted in URL arguments.
+URL_SAFE_CHARACTERS = RFC3986_SUBDELIMS + "/~:@"
+URL_ID_PLACEHOLDER = 'IMAGE-ID-PLACEHOLDER'
+
+
+@lru_cache(maxsize=None)
+def url_template(view_name: str, kwargs: tuple, script_prefix: str, urlconf: Optional[str]) -> Tuple[str, str]:
+    '''
+    This function returns the parts of the reversed URL before and after URL_ID_PLACEHOLDER.
+    Results are cached for the process, keyed by everything reverse() depends on.
+    '''
+    prefix, _, suffix = reverse(view_name, kwargs=dict(kwargs), urlconf=urlconf).partition(URL_ID_PLACEHOLDER)
+    return prefix, suffix
+
+
+def absolute_url_template(request: Request, view_name: str, kwargs: dict) -> Tuple[str, str]:
+    prefix, suffix = url_template(view_name, tuple(sorted(kwargs.items())), get_script_prefix(), get_urlconf())
+    return request.build_absolute_uri(prefix), suffix
+
+
+def create_image_url_dict(request: Request, public_id: str, original_link_access: bool = False, thumbnail_heights: int = []) -> dict:
     '''
-    This function returns a dictionary containing image URLs and their corresponding thumbnail URLs with different heights.
+    This function returns a dictionary containing the URLs of an image (given by its public id) and its thumbnails with different heights.
+    Use ImageURLBuilder directly when building URLs for many images of the same request.
     '''
-    url_dict = {}
-    thumbnail_urls = []
-    for height in thumbnail_heights:
-        thumbnail_url = {}
-        thumbnail_url["height"] = height
-        thumbnail_url["url"] = request.build_absolute_uri(reverse('get_thumbnail', kwargs={
-            "path": image_name, 'height': height}))
-        thumbnail_urls.append(thumbnail_url)
-    if original_link_access:
-        url_dict["original_url"] = request.build_absolute_uri(
-            reverse('get_image', args=[image_name]))
-    url_dict["thumbnails"] = thumbnail_urls
-    return url_dict
+    return ImageURLBuilder(request, original_link_access, thumbnail_heights).build(public_id)
@@ -0,0 +1,139 @@
+from collections import namedtuple
+import io
+import struct
+from typing import BinaryIO, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+)
+SIGNATURE_SIZE = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'mode', 'frames'])
+
+# PIL modes of PNG color types; 1-bit grayscale is '1' and 16-bit grayscale 'I'.
+PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+# PIL modes of JPEG images by number of components.
+JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+# Start of frame markers, which carry the dimensions of a JPEG image. 0xC4, 0xC8 and 0xCC are other segments.
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field.
+JPEG_STANDALONE_MARKERS = frozenset(range(0xD0, 0xD9)) | {0x01}
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    '''
+    This function returns the content type matching the magic bytes at the start of a file, or None if it is not a supported image.
+    '''
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    return None
+
+
+def read_image_header(file: BinaryIO) -> Optional[ImageHeader]:
+    '''
+    This function returns the format, dimensions, PIL mode and frame count of a JPEG or PNG file, parsed from the
+    header alone without decoding any pixel data, or None if the file is not a well-formed JPEG or PNG. Only a few
+    hundred bytes are usually read; the file is rewound.
+    '''
+    file.seek(0)
+    try:
+        content_type = sniff_image_type(_read(file, SIGNATURE_SIZE))
+        if content_type == 'image/png':
+            return _read_png_header(file)
+        if content_type == 'image/jpeg':
+            file.seek(2)
+            return _read_jpeg_header(file)
+        return None
+    except (EOFError, struct.error):
+        return None
+    finally:
+        file.seek(0)
+
+
+def _read(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError()
+    return data
+
+
+def _read_png_header(file: BinaryIO) -> Optional[ImageHeader]:
+    length, chunk_type = struct.unpack('>I4s', _read(file, 8))
+    if chunk_type != b'IHDR' or length != 13:
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', _read(file, 10))
+    mode = PNG_MODES.get(color_type)
+    if mode is None:
+        return None
+    if color_type == 0 and bit_depth == 1:
+        mode = '1'
+    elif color_type == 0 and bit_depth == 16:
+        mode = 'I'
+    return ImageHeader('PNG', width, height, mode, _read_png_frames(file))
+
+
+def _read_png_frames(file: BinaryIO) -> int:
+    '''
+    This function returns the frame count of the animation control chunk of APNG files, which has to come before
+    the image data, or 1. Errors past IHDR are left for the decoder to report.
+    '''
+    # Skip the rest of IHDR and its CRC.
+    file.seek(3 + 4, io.SEEK_CUR)
+    try:
+        while True:
+            length, chunk_type = struct.unpack('>I4s', _read(file, 8))
+            if chunk_type == b'acTL':
+                return struct.unpack('>I', _read(file, 4))[0]
+            if chunk_type in (b'IDAT', b'IEND'):
+                return 1
+            file.seek(length + 4, io.SEEK_CUR)
+    except (EOFError, struct.error):
+        return 1
+
+
+def _read_jpeg_header(file: BinaryIO) -> Optional[ImageHeader]:
+    while True:
+        if _read(file, 1) != b'\xff':
+            return None
+        marker = _read(file, 1)[0]
+        while marker == 0xFF:
+            marker = _read(file, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan data before any frame header.
+            return None
+        length = struct.unpack('>H', _read(file, 2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width, components = struct.unpack('>BHHB', _read(file, 6))
+            mode = JPEG_MODES.get(components)
+            if mode is None:
+                return None
+            return ImageHeader('JPEG', width, height, mode, 1)
+        if length < 2:
+            return None
+        file.seek(length - 2, io.SEEK_CUR)
+
+
+def validate_image_header(file: BinaryIO) -> ImageHeader:
+    '''
+    This function checks the header of an uploaded image before anything decodes it, rejecting files that are not
+    JPEG or PNG images, have a malformed header or more than IMAGE_MAX_UPLOAD_PIXELS pixels. The parsed header is
+    stored as the image_header attribute of the file for read_image_metadata.
+    '''
+    file.seek(0)
+    if sniff_image_type(file.read(SIGNATURE_SIZE)) is None:
+        file.seek(0)
+        raise ValidationError("Only JPEG and PNG images are supported")
+    header = read_image_header(file)
+    if header is None or not header.width or not header.height:
+        raise ValidationError("Unable to read image file")
+    if header.width * header.height > settings.IMAGE_MAX_UPLOAD_PIXELS:
+        raise ValidationError(f"Maximum image size is {settings.IMAGE_MAX_UPLOAD_PIXELS} pixels")
+    file.image_header = header
+    return header
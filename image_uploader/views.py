@@ -6,21 +6,33 @@ from .serializers import UploadedImageSerializer
 from rest_framework import status, permissions
 from django.http import HttpResponse
 from django.conf import settings
-from image_uploader.models import UploadedImage
+from django.db import IntegrityError
+from image_uploader.models import AccountTier, UploadedImage
 import os
+import itertools
+import tarfile
+import zipfile
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authentication import TokenAuthentication
+from .authentication import CachedTokenAuthentication
 from django.shortcuts import get_object_or_404
 from image_uploader.models import UploadedImage
-from io import BytesIO
-from .utils import resize_image_by_height, create_image_url_dict
-from typing import List
+from .utils import create_image_url_dict, thumbnail_width, ImageURLBuilder
+from .signing import read_expiring_link, sign_expiring_link
+from .tokens import ExpiredToken, InvalidToken, make_token
+from .thumbnails import ImageTooLarge, get_thumbnail, get_thumbnail_key, negotiate_output_format
+from django.utils.cache import patch_vary_headers
+from rest_framework import exceptions
+from rest_framework.negotiation import DefaultContentNegotiation
+from .responses import conditional_file_response, make_etag
+from .jobs import enqueue_job, enqueue_jobs
+from .pagination import ImageCursorPagination
+from .executors import RenderQueueFull, get_render_limiter
+from .uploads import ValidatingUploadHandler, iter_archive_images, save_uploaded_images, IMAGES_FIELD, ARCHIVE_FIELD
+from typing import List, Optional
 from django.urls import reverse
 import datetime
 from django.utils import timezone
-from requests.exceptions import RequestException
-import requests
-from django.core.signing import SignatureExpired, BadSignature, Signer
+import time
 
 
 class ObtainAuthTokenView(ObtainAuthToken):
@@ -30,48 +42,141 @@ class ObtainAuthTokenView(ObtainAuthToken):
 class ImageUploadView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
     def post(self, request: Request, *args, **kwargs):
         serializer = UploadedImageSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user=request.user)
+            uploaded_image = serializer.save(user=request.user)
             user_tier = request.user.tier
+            if settings.THUMBNAIL_PREGENERATE and user_tier.thumbnail_heights:
+                enqueue_job('pregenerate_thumbnails', image_id=uploaded_image.id,
+                            heights=list(user_tier.thumbnail_heights), encoding=user_tier.encoding,
+                            max_pixels=user_tier.image_pixel_limit)
             response = {}
             response[serializer.data["image"]] = create_image_url_dict(
-                request, serializer.data["image"], user_tier.access_to_original_image, user_tier.thumbnail_heights)
+                request, uploaded_image.public_id, user_tier.access_to_original_image, user_tier.thumbnail_heights)
             return Response(response, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def get_user_image(user_id: int, path: Optional[str] = None, public_id: Optional[str] = None) -> UploadedImage:
+    '''
+    This function returns the user's image identified by its public id or, for the filename routes, by its name.
+    '''
+    if public_id is not None:
+        return get_object_or_404(UploadedImage, user=user_id, public_id=public_id)
+    return get_object_or_404(UploadedImage, user=user_id, name=os.path.basename(path))
+
+
+class ImageContentNegotiation(DefaultContentNegotiation):
+    '''
+    Image views answer with image bodies whatever the Accept header lists, and use it to pick the image format.
+    Renderers only serialize error responses, so fall back to the first one instead of answering 406.
+    '''
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except exceptions.NotAcceptable:
+            return (renderers[0], renderers[0].media_type)
+
+
+def busy_response() -> Response:
+    return Response({"error": "Too many images are being processed, try again later"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(settings.THUMBNAIL_RENDER_RETRY_AFTER)})
+
+
+def serve_original(request: Request, image: UploadedImage, max_age: int) -> HttpResponse:
+    return conditional_file_response(
+        request, image.open_image, 'image/' + image.image_format, image.etag,
+        image.get_modified_time(), max_age, allow_ranges=True)
+
+
+def too_large_response() -> Response:
+    return Response({"error": "The image is too large to create thumbnails for this user's tier"},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+
+def serve_thumbnail(request: Request, image: UploadedImage, height: int, max_age: int,
+                    tier: Optional[AccountTier] = None) -> HttpResponse:
+    '''
+    This function returns the thumbnail of the image in the format negotiated from the Accept header, encoded
+    with the settings of the tier and refused (ImageTooLarge) when the original exceeds its pixel limit.
+    '''
+    encoding = tier.encoding if tier else None
+    max_pixels = tier.image_pixel_limit if tier else None
+    image_format = negotiate_output_format(image, request.META.get('HTTP_ACCEPT', ''))
+    key = get_thumbnail_key(image, height, image_format, encoding)
+    response = conditional_file_response(
+        request, lambda: get_thumbnail(image, height, image_format, key, encoding, max_pixels)[0],
+        'image/' + image_format, make_etag(key), image.get_modified_time(), max_age)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+class BatchImageUploadView(APIView):
+    parser_classes = (MultiPartParser,)
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def post(self, request: Request, *args, **kwargs):
+        upload_handler = ValidatingUploadHandler(request)
+        # Replace the default handlers before request.data is parsed.
+        request.upload_handlers[:] = [upload_handler]
+        files = [(file.name, file) for file in request.FILES.getlist(IMAGES_FIELD)]
+        rejected = upload_handler.rejected
+        archive = request.FILES.get(ARCHIVE_FIELD)
+        if archive is not None:
+            files = itertools.chain(files, iter_archive_images(
+                archive, rejected, settings.BATCH_UPLOAD_MAX_FILES - len(files)))
+
+        try:
+            images = save_uploaded_images(request.user, files, rejected)
+        except (zipfile.BadZipFile, tarfile.TarError):
+            return Response({"error": "Unable to read archive", "rejected": rejected}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response({"error": "Image names were taken by concurrent uploads, try again", "rejected": rejected},
+                            status=status.HTTP_409_CONFLICT)
+        if not images:
+            return Response({"error": "No valid images were uploaded", "rejected": rejected}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_tier = request.user.tier
+        if settings.THUMBNAIL_PREGENERATE and user_tier.thumbnail_heights:
+            enqueue_jobs('pregenerate_thumbnails', [
+                {'image_id': image.id, 'heights': list(user_tier.thumbnail_heights),
+                 'encoding': user_tier.encoding, 'max_pixels': user_tier.image_pixel_limit} for image in images])
+        url_builder = ImageURLBuilder(request, user_tier.access_to_original_image, user_tier.thumbnail_heights)
+        uploaded = {}
+        for image in images:
+            uploaded[image.image_name] = url_builder.build(image.public_id)
+        return Response({"images": uploaded, "rejected": rejected}, status=status.HTTP_201_CREATED)
+
+
 class ImageOriginalView(APIView):
+    content_negotiation_class = ImageContentNegotiation
     permission_classes = (permissions.IsAuthenticated,)
 
-    def get(self, request: Request, path: str) -> Response:
+    def get(self, request: Request, path: Optional[str] = None, public_id: Optional[str] = None) -> Response:
         user_tier = request.user.tier
         user_id = request.user.id
 
         if not user_tier.access_to_original_image:
             return Response({"error": "The requested original image is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
-        file_name = os.path.basename(path)
-        image = get_object_or_404(
-            UploadedImage, user=user_id, image="images/" + file_name)
+        image = get_user_image(user_id, path, public_id)
         try:
-            image_pil = image.get_image_file()
-            output = BytesIO()
-            image_pil.save(output, format=image_pil.format)
-            response = HttpResponse(
-                output.getvalue(), content_type='image/'+image_pil.format)
-            return response
+            return serve_original(request, image, user_tier.cache_max_age)
         except IOError:
             return Response({"error": "Unable to read image file"}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class ImageThumbnailView(APIView):
+    content_negotiation_class = ImageContentNegotiation
     permission_classes = (permissions.IsAuthenticated,)
 
-    def get(self, request, path: str, height: int) -> Response:
+    def get(self, request, height: int, path: Optional[str] = None, public_id: Optional[str] = None) -> Response:
         user_tier = request.user.tier
         user_id = request.user.id
         if height is not None:
@@ -80,18 +185,13 @@ class ImageThumbnailView(APIView):
         else:
             return Response({"error": "No thumbnail size provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_name = os.path.basename(path)
-        image = get_object_or_404(
-            UploadedImage, user=user_id, image="images/" + file_name)
+        image = get_user_image(user_id, path, public_id)
         try:
-            image_pil = image.get_image_file()
-            if height is not None:
-                image_pil = resize_image_by_height(image_pil, height)
-            output = BytesIO()
-            image_pil.save(output, format=image_pil.format)
-            response = HttpResponse(
-                output.getvalue(), content_type='image/'+image_pil.format)
-            return response
+            return serve_thumbnail(request, image, height, user_tier.cache_max_age, user_tier)
+        except RenderQueueFull:
+            return busy_response()
+        except ImageTooLarge:
+            return too_large_response()
         except IOError:
             return Response({"error": "Unable to read image file"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -104,36 +204,41 @@ class GetExpiringLinkView(APIView):
 
     def get(self, request, *args, **kwargs):
         path = kwargs.get('path', '')
+        public_id = kwargs.get('public_id', None)
         height = kwargs.get('height', None)
         expire = kwargs.get('expire', None)
 
         if not request.user.tier.expiring_link_creation:
             return Response({"error": "The requested operation is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not path:
+        if not path and not public_id:
             return Response({"error": "No image name provided"}, status=status.HTTP_400_BAD_REQUEST)
 
         if not height:
+            if not request.user.tier.access_to_original_image:
+                return Response({"error": "The requested original image is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
             is_thumbnail = False
-            image_url = request.build_absolute_uri(
-                reverse('get_image', args=[path]))
         else:
+            if height not in request.user.tier.thumbnail_heights:
+                return Response({"error": "The requested thumbnail height is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
             is_thumbnail = True
-            image_url = request.build_absolute_uri(
-                reverse('get_thumbnail', args=[path, height]))
 
         try:
-            expire_seconds = int(expire)
-            if expire_seconds < 300 or expire_seconds > 30000:
-                raise ValueError(
-                    'Expiration time must be between 300 and 30000 seconds')
-        except ValueError:
+            expire_seconds = parse_expire_seconds(expire)
+        except (TypeError, ValueError):
             return Response({"error": "Expiration time must be an integer between 300 and 30000"}, status=status.HTTP_400_BAD_REQUEST)
 
-        expire_at = timezone.now() + timezone.timedelta(seconds=expire_seconds)
-        expire_at = expire_at.isoformat()
+        image = get_user_image(request.user.id, path, public_id)
+        if is_thumbnail:
+            image_url = reverse('get_thumbnail_by_id', args=[image.public_id, height])
+        else:
+            image_url = reverse('get_image_by_id', args=[image.public_id])
+        image_url = request.build_absolute_uri(image_url)
+        # Tokens carry whole seconds.
+        expire_at = (timezone.now() + timezone.timedelta(seconds=expire_seconds)).replace(microsecond=0)
         expiring_url = request.build_absolute_uri(
-            self.generate_expiring_url(image_url, expire_at))
+            self.generate_expiring_url(image.id, height, expire_at))
+        expire_at = expire_at.isoformat()
 
         response_data = {
             'expiring_url': expiring_url,
@@ -145,51 +250,140 @@ class GetExpiringLinkView(APIView):
 
         return Response(response_data)
 
-    def generate_expiring_url(self, url: str, expire_at) -> str:
-        signer = Signer()
-        signature = signer.sign_object({"url": url, "expires_at": expire_at})
-        url = reverse('use_expiring_url') + '?signature=' + signature
-        return url
+    def generate_expiring_url(self, image_id: int, height: Optional[int], expire_at: datetime.datetime) -> str:
+        return sign_expiring_link(image_id, height, expire_at)
+
+
+def parse_expire_seconds(expire) -> int:
+    expire_seconds = int(expire)
+    if expire_seconds < 300 or expire_seconds > 30000:
+        raise ValueError('Expiration time must be between 300 and 30000 seconds')
+    return expire_seconds
+
+
+class ImageManifestView(APIView):
+    '''
+    Returns the URLs of many images of the user in one response: for each public id in "ids", its thumbnail URLs
+    with their widths, the original URL when the tier allows it and a srcset attribute value. With "expire"
+    (seconds), expiring links to all of them are signed as well, and the srcset uses those, since browsers
+    cannot authenticate <img> requests.
+    '''
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request: Request) -> Response:
+        user_tier = request.user.tier
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(public_id, str) for public_id in ids):
+            return Response({"error": "ids must be a list of image ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.IMAGE_MANIFEST_MAX_IMAGES:
+            return Response({"error": f"Maximum number of images is {settings.IMAGE_MANIFEST_MAX_IMAGES}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        expire = request.data.get('expire')
+        if expire is not None:
+            if not user_tier.expiring_link_creation:
+                return Response({"error": "The requested operation is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                expire_seconds = parse_expire_seconds(expire)
+            except (TypeError, ValueError):
+                return Response({"error": "Expiration time must be an integer between 300 and 30000"}, status=status.HTTP_400_BAD_REQUEST)
+
+        images = {image['public_id']: image for image in UploadedImage.objects.filter(
+            user=request.user.id, public_id__in=ids).values('id', 'public_id', 'name', 'width', 'height')}
+        heights = sorted(user_tier.thumbnail_heights)
+        url_builder = ImageURLBuilder(request, user_tier.access_to_original_image, heights)
+        response_data = {"images": {}, "missing": [public_id for public_id in ids if public_id not in images]}
+        if expire is not None:
+            expires_at = int(time.time()) + expire_seconds
+            expiring_url = request.build_absolute_uri(reverse('use_expiring_url') + '?signature=')
+            response_data["expire_at"] = datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).isoformat()
+
+        for public_id in ids:
+            image = images.get(public_id)
+            if image is None or public_id in response_data["images"]:
+                continue
+            entry = {"name": image['name'], "width": image['width'], "height": image['height']}
+            entry.update(url_builder.build(public_id))
+            if expire is not None:
+                if user_tier.access_to_original_image:
+                    entry["expiring_original_url"] = expiring_url + make_token(image['id'], None, expires_at)
+                entry["expiring_thumbnails"] = [
+                    {"height": height, "url": expiring_url + make_token(image['id'], height, expires_at)}
+                    for height in heights]
+            if image['width'] and image['height']:
+                for thumbnails in (entry["thumbnails"], entry.get("expiring_thumbnails", [])):
+                    for thumbnail in thumbnails:
+                        thumbnail["width"] = thumbnail_width(image['width'], image['height'], thumbnail["height"])
+                entry["srcset"] = ', '.join(f'{thumbnail["url"]} {thumbnail["width"]}w' for thumbnail in
+                                            entry.get("expiring_thumbnails", entry["thumbnails"]))
+            response_data["images"][public_id] = entry
+        return Response(response_data)
 
 
 class ExpiringLinkView(APIView):
+    content_negotiation_class = ImageContentNegotiation
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+
     def get(self, request):
-        signature = request.GET.get('signature', '')
-        signer = Signer()
         try:
-            signed_data = signer.unsign_object(signature)
-            url = signed_data['url']
-            expires_at = datetime.datetime.fromisoformat(
-                signed_data['expires_at'])
-            if expires_at < timezone.now():
-                return Response({"error": "URL has expired"}, status=status.HTTP_400_BAD_REQUEST)
-        except SignatureExpired:
+            image_id, height, expires_at, path = read_expiring_link(request.GET.get('signature', ''))
+        except ExpiredToken:
             return Response({"error": "URL has expired"}, status=status.HTTP_400_BAD_REQUEST)
-        except (ValueError, BadSignature):
+        except InvalidToken:
             return Response({"error": "Invalid URL"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if path is None:
+            image = get_object_or_404(UploadedImage.objects.select_related('user__tier'), pk=image_id)
+        else:
+            # Links signed as image view URLs were fetched with the credentials of the request, as the user's image.
+            try:
+                credentials = CachedTokenAuthentication().authenticate(request)
+            except exceptions.AuthenticationFailed:
+                credentials = None
+            if credentials is None:
+                return Response({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED, headers={'WWW-Authenticate': 'Token'})
+            user = credentials[0]
+            if height is None and not user.tier.access_to_original_image:
+                return Response({"error": "The requested original image is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
+            if height is not None and height not in user.tier.thumbnail_heights:
+                return Response({"error": "The requested thumbnail height is not allowed for this user's tier"}, status=status.HTTP_400_BAD_REQUEST)
+            image = get_user_image(user.id, path)
+            image.user = user
+        # Clients must not keep the image longer than the link is valid.
+        max_age = int(expires_at - time.time())
         try:
-            token = request.auth
-            headers = {'Authorization': f'Token {token}'}
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                content = response.content
-                content_type = response.headers['content-type']
-                return HttpResponse(content, content_type=content_type)
-            else:
-                return HttpResponse(status=response.status_code)
-        except RequestException as e:
-            return Response({"error": "Invalid URL"}, status=status.HTTP_400_BAD_REQUEST)
+            if height:
+                return serve_thumbnail(request, image, int(height), max_age, image.user.tier)
+            return serve_original(request, image, max_age)
+        except RenderQueueFull:
+            return busy_response()
+        except ImageTooLarge:
+            return too_large_response()
+        except IOError:
+            return Response({"error": "Unable to read image file"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class RenderMetricsView(APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request: Request) -> Response:
+        return Response({"thumbnail_render": get_render_limiter().stats()})
 
 
 class UserImageListView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request: Request):
-        images = UploadedImage.objects.filter(user=request.user.id)
+        images = UploadedImage.objects.filter(user=request.user.id).values('id', 'name', 'public_id')
+        paginator = ImageCursorPagination()
+        page = paginator.paginate_queryset(images, request, view=self)
         user_tier = request.user.tier
+        url_builder = ImageURLBuilder(request, user_tier.access_to_original_image, user_tier.thumbnail_heights)
         image_urls = {}
-        for image in images:
-            image_urls[image.image_name] = create_image_url_dict(
-                request, image.image_name, user_tier.access_to_original_image, user_tier.thumbnail_heights)
-        return Response(image_urls)
+        for image in page:
+            image_urls[image['name']] = url_builder.build(image['public_id'])
+        return paginator.get_paginated_response(image_urls)
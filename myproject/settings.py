@@ -45,7 +45,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'image_uploader.authentication.CachedTokenAuthentication',
     ]
 }
 
@@ -139,6 +139,48 @@ WHITELISTED_IMAGE_TYPES = {
     'png': 'image/png'
 }
 
+# Maximum size of a single uploaded image in bytes
+IMAGE_MAX_UPLOAD_SIZE = 2 * 1024 * 1024
+
+# Maximum pixel count (width x height) of an uploaded image, checked in its header before it is decoded.
+# Pillow refuses to open images over 2 * PIL.Image.MAX_IMAGE_PIXELS (178956970) as decompression bombs.
+IMAGE_MAX_UPLOAD_PIXELS = 178_956_970
+
+# Batch uploads: maximum number of images per request and maximum size of an uploaded zip/tar archive
+BATCH_UPLOAD_MAX_FILES = 100
+BATCH_UPLOAD_MAX_ARCHIVE_SIZE = 50 * 1024 * 1024
+
+# Image list pagination: default number of images per page and the largest page_size a client may request
+IMAGE_LIST_PAGE_SIZE = 100
+IMAGE_LIST_MAX_PAGE_SIZE = 1000
+
+# On-demand thumbnail rendering: maximum concurrent renders per process, maximum total pixels of the originals
+# being rendered at once, and seconds a request waits for a slot (including waiting for a concurrent render of
+# the same thumbnail) before getting a 503 with Retry-After
+THUMBNAIL_RENDER_CONCURRENCY = os.cpu_count() or 2
+THUMBNAIL_RENDER_MAX_PIXELS = 100_000_000
+THUMBNAIL_RENDER_QUEUE_TIMEOUT = 10
+THUMBNAIL_RENDER_RETRY_AFTER = 5
+
+# Lock making concurrent requests for the same uncached thumbnail wait for a single render: ProcessRenderLock
+# (threads of one process), FileRenderLock (processes sharing MEDIA_ROOT) or DatabaseRenderLock (any host, PostgreSQL)
+THUMBNAIL_RENDER_LOCK = 'image_uploader.locks.FileRenderLock'
+
+# Threads rendering thumbnails for the async (ASGI) image views, and the size (bytes) up to which they read a
+# file into memory on those threads; larger files are streamed as a synchronous FileResponse to bound per-request
+# memory, which keeps a thread busy for the whole transfer (Django 4.1 cannot stream async iterators)
+ASYNC_IMAGE_THREADS = 4
+ASYNC_IMAGE_BUFFER_MAX_SIZE = 1024 * 1024
+
+# Default limit of the pixel count (width x height) of originals thumbnails are rendered from, which
+# AccountTier.max_image_pixels overrides. Pillow refuses to open images over 2 * PIL.Image.MAX_IMAGE_PIXELS
+# whatever the limit.
+THUMBNAIL_MAX_IMAGE_PIXELS = 100_000_000
+
+# Cache used by CachedTokenAuthentication and how long (seconds) a token, its user and tier stay cached
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
 AUTH_USER_MODEL = 'image_uploader.User'
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -183,3 +225,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Other variables
 EXPIRING_LINK_MAX_AGE = 30_000
+
+# Secrets signing expiring link tokens by key id (1-255) and the id of the key new links are signed with. To
+# rotate, add a key under a new id and switch EXPIRING_LINK_KEY_ID to it; remove the old key once links signed
+# with it have expired (at most EXPIRING_LINK_MAX_AGE seconds later), which invalidates any that remain.
+EXPIRING_LINK_KEYS = {1: SECRET_KEY}
+EXPIRING_LINK_KEY_ID = 1
+
+# Maximum number of image ids per request to the image manifest endpoint
+IMAGE_MANIFEST_MAX_IMAGES = 100
+
+# Storage of uploaded images: a django.core.files.storage.Storage class and its keyword arguments. Blobs are
+# sharded by content hash (images/ab/cd/<hash>.<format>). image_uploader.storage.LocalObjectStorage stands
+# in for an S3-compatible object store; thumbnails are always cached on the local disk under MEDIA_ROOT.
+IMAGE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+IMAGE_STORAGE_OPTIONS = {}
+
+# Let a fronting proxy send image files: None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd).
+# For X-Accel-Redirect, IMAGE_SENDFILE_URL must be an internal location aliased to MEDIA_ROOT.
+IMAGE_SENDFILE_BACKEND = None
+IMAGE_SENDFILE_URL = '/protected-media/'
+
+# Thumbnail cache, stored under MEDIA_ROOT and bounded by total size in bytes
+THUMBNAIL_CACHE_DIR = os.path.join('cache', 'thumbnails')
+THUMBNAIL_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+# Render all tier thumbnails right after an image is uploaded
+THUMBNAIL_PREGENERATE = True
+
+# Background image processing. DatabaseJobQueue jobs are consumed by `manage.py process_image_jobs`,
+# ThreadJobQueue runs them in the web process and ImmediateJobQueue inside the request.
+IMAGE_JOB_QUEUE = 'image_uploader.jobs.DatabaseJobQueue'
+IMAGE_JOB_THREADS = 2
+IMAGE_JOB_MAX_ATTEMPTS = 3
+IMAGE_JOB_STALE_AFTER = 600
+
+# Resizing quality. THUMBNAIL_RESAMPLE is a PIL.Image.Resampling name; THUMBNAIL_REDUCING_GAP lets Pillow
+# shrink by an integer factor before resampling (None resizes in one exact pass, larger values are closer
+# to it); THUMBNAIL_JPEG_DRAFT lets the JPEG decoder produce a downscaled image directly.
+THUMBNAIL_RESAMPLE = 'LANCZOS'
+THUMBNAIL_REDUCING_GAP = 3.0
+THUMBNAIL_JPEG_DRAFT = True
+
+# Thumbnail formats served instead of the original's format to clients listing them in Accept, in order of
+# preference (formats the installed Pillow cannot encode are skipped)
+THUMBNAIL_NEGOTIATED_FORMATS = ['AVIF', 'WEBP']
+
+# Named thumbnail encoder settings, selected by AccountTier.encoding_profile (THUMBNAIL_DEFAULT_ENCODING_PROFILE
+# when empty or unknown). Per output format: keyword arguments of PIL.Image.save, plus 'colors' to quantize to a
+# palette. 'strip_exif' and 'strip_icc' drop the metadata of the original, and 'heights' maps a maximum thumbnail
+# height to per-format overrides, the smallest matching one applying. AccountTier.thumbnail_quality overrides
+# the quality of lossy formats. Compare profiles with `manage.py benchmark encoders`.
+THUMBNAIL_ENCODING_PROFILES = {
+    'default': {
+        'JPEG': {'quality': 85, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 80, 'method': 4},
+        'AVIF': {'quality': 60},
+        'strip_exif': True,
+        'strip_icc': False,
+        'heights': {
+            200: {'JPEG': {'quality': 80}, 'WEBP': {'quality': 75}},
+        },
+    },
+    'compact': {
+        'JPEG': {'quality': 70, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'PNG': {'optimize': True, 'colors': 256},
+        'WEBP': {'quality': 65, 'method': 6},
+        'AVIF': {'quality': 45},
+        'strip_exif': True,
+        'strip_icc': True,
+    },
+    'fast': {
+        'JPEG': {'quality': 80},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 80, 'method': 0},
+        'AVIF': {'quality': 60, 'speed': 8},
+        'strip_exif': True,
+        'strip_icc': False,
+    },
+}
+THUMBNAIL_DEFAULT_ENCODING_PROFILE = 'default'